@@ -0,0 +1,38 @@
+import os
+import time
+
+from aiogram import BaseMiddleware
+
+import database
+
+ADMINS_TTL = float(os.getenv('ADMINS_TTL', 60))
+
+# множество администраторов читается из Admins один раз и обновляется по TTL
+_admin_ids = None
+_loaded_at = 0.0
+
+
+async def get_admin_ids():
+    global _admin_ids, _loaded_at
+    if _admin_ids is None or time.monotonic() - _loaded_at > ADMINS_TTL:
+        async with database.reading() as db:
+            async with db.execute("SELECT AdminUserId FROM Admins") as cursor:
+                admins = await cursor.fetchall()
+        _admin_ids = frozenset(int(admin[0]) for admin in admins)
+        _loaded_at = time.monotonic()
+    return _admin_ids
+
+
+async def is_admin(user_id):
+    return int(user_id) in await get_admin_ids()
+
+
+# проверка доступа для всех сообщений бота-администратора
+class AdminMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        if event.from_user and await is_admin(event.from_user.id):
+            return await handler(event, data)
+        state = data.get("state")
+        if state is not None:
+            await state.clear()
+        await event.answer("У вас нет доступа")
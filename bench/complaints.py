@@ -0,0 +1,82 @@
+import argparse
+import asyncio
+import os
+import tempfile
+
+# Проверка обработки жалоб в админ-боте: модератор проходит по жалобам кнопками, а число
+# обработчиков сообщений в dp_admin не меняется, и каждое действие отвечает ровно один раз.
+#   python -m bench.complaints --reports 30
+
+ADMIN_ID = 42
+ACTIONS = ["✅ Оставить анкету", "❌ Удалить анкету"]
+
+
+def handlers_count(dispatcher):
+    return sum(len(router.message.handlers) for router in dispatcher.chain_tail)
+
+
+async def check(db_path, reports_count):
+    os.environ['DB_PATH'] = db_path
+    for name in ('ADMIN_TOKEN', 'BOT_TOKEN'):
+        os.environ.setdefault(name, '123:BENCH')
+    import bot_admin
+    import database
+    import schema
+    import sender
+    from bench.fake import FakeSession, text_update
+
+    session = FakeSession()
+    bot_admin.bot_admin.session = session
+    bot_admin.other_bot.session = session
+    dp, telegram_bot = bot_admin.dp_admin, bot_admin.bot_admin
+
+    await database.connect()
+    await schema.migrate()
+    await sender.start()
+    try:
+        async with database.writing() as db:
+            await db.execute('INSERT INTO Admins (AdminUserId, AdminChatId) VALUES (?, ?)', (ADMIN_ID, ADMIN_ID))
+            await db.executemany(
+                'INSERT INTO UserProfiles (UserId, PetName, Age, Breed, About, ChatId) VALUES (?, ?, 1, ?, ?, ?)',
+                [(user_id, f'pet{user_id}', 'breed', 'about', user_id) for user_id in range(1000, 1000 + reports_count)])
+            await db.executemany('INSERT INTO Reports (UserId, ReportedId, ReportDescription) VALUES (1, ?, ?)',
+                                 [(user_id, f'report{user_id}') for user_id in range(1000, 1000 + reports_count)])
+
+        before = handlers_count(dp)
+        counts = []
+        await dp.feed_update(telegram_bot, text_update(telegram_bot, ADMIN_ID, "/complaints"))
+        for i in range(reports_count):
+            session.requests.clear()
+            await dp.feed_update(telegram_bot, text_update(telegram_bot, ADMIN_ID, ACTIONS[i % len(ACTIONS)]))
+            counts.append(handlers_count(dp))
+            replies = [request.text for request in session.requests
+                       if getattr(request, 'chat_id', None) == ADMIN_ID and getattr(request, 'text', None)]
+            # ответ на действие и следующая жалоба (или сообщение, что жалоб больше нет)
+            if len(replies) != 2:
+                print(f"действие {i}: ожидалось 2 ответа, получено {len(replies)}: {replies}")
+                return 1
+
+        async with database.reading() as db:
+            async with db.execute('SELECT COUNT(*) FROM Reports') as cursor:
+                left = (await cursor.fetchone())[0]
+        failures = sum(count != before for count in counts) + (left != 0)
+        print(f"жалоб: {reports_count}, обработчиков до: {before}, после: {sorted(set(counts))}, "
+              f"жалоб осталось: {left}")
+        return failures
+    finally:
+        await sender.close()
+        await database.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Проверка числа обработчиков при разборе жалоб')
+    parser.add_argument('--reports', type=int, default=30)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        failures = asyncio.run(check(os.path.join(tmp, 'complaints.db'), args.reports))
+    raise SystemExit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import datetime
+import itertools
+
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Chat, Message, Update
+
+# Сессия бота без сети: запросы складываются в список, ответы собираются на месте
+
+
+class FakeSession(BaseSession):
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+        self.message_ids = itertools.count(1)
+
+    def fake_message(self, bot, method):
+        return Message(
+            message_id=next(self.message_ids),
+            date=datetime.datetime.now(),
+            chat=Chat(id=getattr(method, 'chat_id', 0) or 0, type='private'),
+            text=getattr(method, 'text', None) or getattr(method, 'caption', None),
+        ).as_(bot)
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests.append(method)
+        returning = method.__returning__
+        if returning is Message:
+            return self.fake_message(bot, method)
+        if getattr(returning, '__origin__', None) is list:
+            return [self.fake_message(bot, method) for _ in method.media]
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+    async def close(self):
+        pass
+
+
+_ids = itertools.count(1)
+
+
+def _user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"}
+
+
+def text_update(bot, user_id, text):
+    return Update.model_validate({
+        "update_id": next(_ids),
+        "message": {
+            "message_id": next(_ids), "date": 0, "text": text,
+            "chat": {"id": user_id, "type": "private"}, "from": _user(user_id),
+        },
+    }, context={"bot": bot})
+
+
+def callback_update(bot, user_id, data):
+    return Update.model_validate({
+        "update_id": next(_ids),
+        "callback_query": {
+            "id": str(next(_ids)), "chat_instance": "bench", "data": data, "from": _user(user_id),
+            "message": {"message_id": next(_ids), "date": 0, "text": "-", "chat": {"id": user_id, "type": "private"}},
+        },
+    }, context={"bot": bot})
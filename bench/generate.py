@@ -0,0 +1,113 @@
+import argparse
+import asyncio
+import math
+import os
+import random
+
+# Синтетическая база для бенчмарков: анкеты кучкуются вокруг городов,
+# лайки и жалобы в основном между соседями по городу.
+#   python -m bench.generate --profiles 20000 --likes 100000 --reports 500 --out bench.db
+
+CITIES = [
+    # (широта, долгота, вес, разброс в км)
+    (53.902, 27.561, 40, 8),   # Минск
+    (52.424, 31.014, 10, 5),   # Гомель
+    (53.132, 23.168, 8, 5),    # Белосток
+    (55.755, 37.617, 25, 15),  # Москва
+    (54.687, 25.279, 8, 6),    # Вильнюс
+    (50.450, 30.523, 9, 10),   # Киев
+]
+BREEDS = ['Лабрадор ретривер', 'Мопс', 'Такса', 'Корги', 'Хаски', 'Бигль', 'Шпиц', 'Британская кошка',
+          'Мейн-кун', 'Сфинкс', 'Дворняжка', 'Овчарка']
+WORDS = ['добрый', 'игривый', 'спокойный', 'любит', 'гулять', 'мяч', 'детей', 'кошек', 'плавать', 'спать',
+         'ласковый', 'умный', 'активный', 'пушистый']
+BASE_USER_ID = 100_000_000
+
+
+def random_location(rng, city):
+    lat, lon, _, spread_km = city
+    return (lat + rng.gauss(0, spread_km) / 111.0,
+            lon + rng.gauss(0, spread_km) / (111.0 * math.cos(math.radians(lat))))
+
+
+def generate_profiles(rng, count):
+    weights = [city[2] for city in CITIES]
+    profiles, cities = [], {}
+    for i in range(count):
+        user_id = BASE_USER_ID + i
+        city = rng.choices(range(len(CITIES)), weights)[0]
+        latitude, longitude = random_location(rng, CITIES[city])
+        about = ' '.join(rng.sample(WORDS, rng.randint(2, 6)))
+        photo = f'bench-photo-{i}' if rng.random() < 0.8 else None
+        profiles.append((user_id, f'Питомец {i}', rng.randint(1, 15), rng.choice(BREEDS), about, photo,
+                         f'user{user_id}', latitude, longitude, user_id))
+        cities.setdefault(city, []).append(user_id)
+    return profiles, cities
+
+
+def generate_pairs(rng, cities, count, local_share=0.9):
+    everyone = [user_id for members in cities.values() for user_id in members]
+    pairs = set()
+    attempts = 0
+    while len(pairs) < count and attempts < count * 10:
+        attempts += 1
+        members = rng.choice(list(cities.values())) if rng.random() < local_share else everyone
+        user_id, viewed_id = rng.choice(members), rng.choice(members)
+        if user_id != viewed_id:
+            pairs.add((user_id, viewed_id))
+    return list(pairs)
+
+
+async def generate(out, profiles_count, likes_count, reports_count, seed):
+    os.environ['DB_PATH'] = out
+    os.environ.setdefault('MAIN_TOKEN', '123:BENCH')
+    import database
+    import schema
+
+    rng = random.Random(seed)
+    profiles, cities = generate_profiles(rng, profiles_count)
+    likes = [(user_id, viewed_id, rng.choices(['like', 'dislike', 'mutual_like'], [70, 25, 5])[0], rng.random() < 0.5)
+             for user_id, viewed_id in generate_pairs(rng, cities, likes_count)]
+    reports = [(user_id, reported_id, rng.choice(['спам', 'не питомец', 'оскорбления']))
+               for user_id, reported_id in generate_pairs(rng, cities, reports_count)]
+
+    await database.connect()
+    try:
+        await schema.migrate()
+        async with database.writing() as db:
+            await db.executemany('''
+                INSERT OR REPLACE INTO UserProfiles (UserId, PetName, Age, Breed, About, Photo, LinkOnUserName, Latitude, Longitude, ChatId)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', profiles)
+            await db.executemany('''
+                INSERT OR IGNORE INTO Likes (UserId, ViewedId, State, ViewedByUser) VALUES (?, ?, ?, ?)
+            ''', likes)
+            await db.executemany('''
+                INSERT OR IGNORE INTO Reports (UserId, ReportedId, ReportDescription) VALUES (?, ?, ?)
+            ''', reports)
+            await db.execute('''
+                INSERT INTO ProfileLocations (UserId, MinLat, MaxLat, MinLon, MaxLon)
+                SELECT UserId, Latitude, Latitude, Longitude, Longitude FROM UserProfiles
+            ''')
+            await db.execute('INSERT INTO ProfileTexts (rowid, Breed, About) SELECT UserId, Breed, About FROM UserProfiles')
+    finally:
+        await database.close()
+    print(f"{out}: {len(profiles)} анкет, {len(likes)} реакций, {len(reports)} жалоб")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Синтетическая база petdating для бенчмарков')
+    parser.add_argument('--profiles', type=int, default=20000)
+    parser.add_argument('--likes', type=int, default=100000)
+    parser.add_argument('--reports', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', default='bench.db')
+    args = parser.parse_args()
+    for path in (args.out, f'{args.out}-wal', f'{args.out}-shm'):
+        if os.path.exists(path):
+            os.remove(path)
+    asyncio.run(generate(args.out, args.profiles, args.likes, args.reports, args.seed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+import argparse
+import asyncio
+import gc
+import heapq
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+# Память и время ранжирования кандидатов в разных представлениях анкеты:
+#   select_star — строки SELECT * и пары (строка, дистанция), как в ранних версиях поиска;
+#   tuples      — кортежи (UserId, Latitude, Longitude) и пары (кортеж, дистанция);
+#   batch       — столбцы CandidateBatch, Candidate только для страницы.
+#   python -m bench.generate --out bench.db && python -m bench.memory --db bench.db
+
+LOCATION = (53.902, 27.561)
+
+
+async def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    held = await build()
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del held
+    return current, peak, elapsed_ms
+
+
+async def run(db_path, limit):
+    os.environ['DB_PATH'] = db_path
+    import database
+    import search
+    from distance import batch_distances, FAST
+    from profiles import CandidateBatch, RANKING_COLUMNS
+
+    async def fetch(columns):
+        async with database.reading() as db:
+            async with db.execute(f'SELECT {columns} FROM UserProfiles u WHERE u.Latitude IS NOT NULL') as cursor:
+                return await cursor.fetchall()
+
+    def ranked_pairs(rows, lat_index, lon_index):
+        distances = batch_distances(LOCATION[0], LOCATION[1], [row[lat_index] for row in rows],
+                                    [row[lon_index] for row in rows], accuracy=FAST)
+        ranked = [(row, float(distance)) for row, distance in zip(rows, distances)]
+        return ranked, heapq.nsmallest(limit, ranked, key=lambda x: (x[1], x[0][0]))
+
+    # в памяти остается то, что поиск держит до конца ранжирования
+    async def select_star():
+        return ranked_pairs(await fetch('*'), -3, -2)
+
+    async def tuples():
+        return ranked_pairs(await fetch('u.UserId, u.Latitude, u.Longitude'), 1, 2)
+
+    async def batch():
+        candidates = CandidateBatch(await fetch(RANKING_COLUMNS))
+        return candidates, search.rank_profiles(LOCATION, candidates, limit=limit)
+
+    await database.connect()
+    try:
+        report = {}
+        # прогрев кэша страниц SQLite, чтобы первый вариант не платил за чтение с диска
+        await fetch(RANKING_COLUMNS)
+        for name, build in (('select_star', select_star), ('tuples', tuples), ('batch', batch)):
+            current, peak, elapsed_ms = await measure(build)
+            report[name] = {"held_kb": round(current / 1024, 1), "peak_kb": round(peak / 1024, 1),
+                            "fetch_rank_ms": round(elapsed_ms, 2)}
+
+        # окно колоды в SessionStates: было [[UserId, Latitude, Longitude], дистанция], стало [UserId, дистанция]
+        candidates = CandidateBatch(await fetch(RANKING_COLUMNS))
+        page = search.rank_profiles(LOCATION, candidates, limit=limit)
+        old_window = [[[c.user_id, c.latitude, c.longitude], c.distance] for c in page]
+        new_window = [c.to_deck() for c in page]
+        report["deck_window_bytes"] = {"old": len(json.dumps(old_window)), "new": len(json.dumps(new_window))}
+        report["candidates"] = len(candidates)
+        return report
+    finally:
+        await database.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Память представлений анкеты в поиске')
+    parser.add_argument('--db', default='bench.db', help='база из bench.generate; замер идет на ее копии')
+    parser.add_argument('--limit', type=int, default=20, help='размер страницы')
+    parser.add_argument('--json', action='store_true', help='вывести отчет одной JSON-строкой')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'memory.db')
+        shutil.copy(args.db, db_path)
+        report = asyncio.run(run(db_path, args.limit))
+    if args.json:
+        print(json.dumps(report))
+        return
+    print(f"кандидатов: {report['candidates']}")
+    print(f"{'representation':<16}{'held KB':>12}{'peak KB':>12}{'fetch+rank ms':>16}")
+    for name in ('select_star', 'tuples', 'batch'):
+        row = report[name]
+        print(f"{name:<16}{row['held_kb']:>12.1f}{row['peak_kb']:>12.1f}{row['fetch_rank_ms']:>16.2f}")
+    window = report["deck_window_bytes"]
+    print(f"окно колоды ({args.limit} анкет) в SessionStates: {window['old']} -> {window['new']} байт")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+from bench.run import percentile
+
+# Проигрывание лога апдейтов (UPDATES_RECORD_PATH, для --bot admin — ADMIN_UPDATES_RECORD_PATH)
+# через настоящий диспетчер на копии базы и FakeSession:
+#   python -m bench.replay --log updates.jsonl.gz --db petdating.db --speed 1    # в исходном темпе
+#   python -m bench.replay --log updates.jsonl.gz --db petdating.db --speed 0    # так быстро, как получится
+
+
+async def replay(log_path, db_path, bot_name, speed, concurrency):
+    os.environ['DB_PATH'] = db_path
+    for name in ('UPDATES_RECORD_PATH', 'ADMIN_UPDATES_RECORD_PATH'):
+        os.environ.pop(name, None)
+    for token in ('MAIN_TOKEN', 'ADMIN_TOKEN', 'BOT_TOKEN'):
+        os.environ.setdefault(token, '123:REPLAY')
+    from aiogram.types import Update
+
+    import database
+    import metrics
+    import queues
+    import reactions
+    import schema
+    import recorder
+    from bench.fake import FakeSession
+
+    session = FakeSession()
+    if bot_name == 'main':
+        import bot
+        dispatcher, telegram_bot = bot.dp, bot.bot
+        bot.bot.session = session
+    else:
+        import bot_admin
+        dispatcher, telegram_bot = bot_admin.dp_admin, bot_admin.bot_admin
+        bot_admin.bot_admin.session = session
+        bot_admin.other_bot.session = session
+
+    await database.connect()
+    await schema.migrate()
+    await reactions.start()
+    await queues.start()
+    latencies = []
+    lags = []
+    slots = asyncio.Semaphore(concurrency)
+    tasks = set()
+
+    async def feed(update):
+        started = time.perf_counter()
+        try:
+            await dispatcher.feed_update(telegram_bot, update)
+        except Exception as e:
+            print(f"Ошибка при обработке апдейта {update.update_id}: {e}")
+        finally:
+            latencies.append((time.perf_counter() - started) * 1000)
+            slots.release()
+
+    try:
+        first = None
+        started = time.monotonic()
+        for recorded_at, data in recorder.read_log(log_path):
+            if first is None:
+                first = recorded_at
+            if speed > 0:
+                delay = (recorded_at - first) / speed - (time.monotonic() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    lags.append(-delay * 1000)
+            await slots.acquire()
+            task = asyncio.create_task(feed(Update.model_validate(data, context={"bot": telegram_bot})))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - started
+    finally:
+        await queues.close()
+        await reactions.close()
+        await database.close()
+
+    print(f"апдейтов: {len(latencies)}, время: {elapsed:.2f} с, {len(latencies) / elapsed if elapsed else 0:.1f} апд/с, "
+          f"запросов к Bot API: {len(session.requests)}")
+    print(f"задержка обработки: p50 {percentile(latencies, 0.5):.2f} мс, p99 {percentile(latencies, 0.99):.2f} мс, "
+          f"max {max(latencies, default=0):.2f} мс")
+    if lags:
+        print(f"отставание от исходного темпа: p99 {percentile(lags, 0.99):.2f} мс")
+    print(f"{'handler':<28}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, row in sorted(metrics.snapshot()["handlers"].items(), key=lambda item: -item[1]["count"]):
+        print(f"{name:<28}{row['count']:>8}{row['errors']:>8}{row['p50_ms']:>10.2f}{row['p99_ms']:>10.2f}{row['max_ms']:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Проигрывание записанных апдейтов на копии базы')
+    parser.add_argument('--log', required=True, help='лог бота --bot (.jsonl или .jsonl.gz)')
+    parser.add_argument('--db', default='petdating.db', help='база, на копии которой идет проигрывание')
+    parser.add_argument('--bot', choices=['main', 'admin'], default='main')
+    parser.add_argument('--speed', type=float, default=1.0, help='множитель темпа; 0 — без пауз')
+    parser.add_argument('--concurrency', type=int, default=100, help='сколько апдейтов обрабатывается одновременно')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'replay.db')
+        shutil.copy(args.db, db_path)
+        asyncio.run(replay(args.log, db_path, args.bot, args.speed, args.concurrency))
+
+
+if __name__ == '__main__':
+    main()
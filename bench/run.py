@@ -0,0 +1,130 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+# Прогон настоящих обработчиков bot.py через FakeSession без сети, по фазам:
+# поиск -> выбор режима -> свайпы -> лайки -> ответ на лайк. Все пользователи фазы работают параллельно.
+#   python -m bench.generate --out bench.db && python -m bench.run --db bench.db --users 100 --swipes 30
+# Исходящие уведомления остаются в очереди sender: меряем обработчики и базу, а не лимиты Telegram.
+
+FLOWS = ('search_profiles', 'start_search', 'handle_reaction', 'show_likes', 'handle_like_reaction')
+
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+async def run(db_path, users_count, swipes, mode, seed):
+    os.environ['DB_PATH'] = db_path
+    os.environ.setdefault('MAIN_TOKEN', '123:BENCH')
+    import bot
+    import database
+    import queues
+    import reactions
+    import schema
+    from bench.fake import FakeSession, callback_update, text_update
+
+    session = FakeSession()
+    bot.bot.session = session
+    dp, telegram_bot = bot.dp, bot.bot
+    rng = random.Random(seed)
+
+    await database.connect()
+    await schema.migrate()
+    await reactions.start()
+    await queues.start()
+    try:
+        async with database.reading() as db:
+            async with db.execute('SELECT UserId FROM UserProfiles WHERE Latitude IS NOT NULL') as cursor:
+                user_ids = [row[0] for row in await cursor.fetchall()]
+        users = rng.sample(user_ids, min(users_count, len(user_ids)))
+        latencies = {flow: [] for flow in FLOWS}
+        wall = {flow: 0.0 for flow in FLOWS}
+
+        async def feed(flow, update):
+            started = time.perf_counter()
+            await dp.feed_update(telegram_bot, update)
+            latencies[flow].append((time.perf_counter() - started) * 1000)
+
+        async def phase(flow, make_updates):
+            started = time.perf_counter()
+
+            async def one_user(user_id):
+                for update in make_updates(user_id):
+                    await feed(flow, update)
+
+            await asyncio.gather(*(one_user(user_id) for user_id in users))
+            wall[flow] += time.perf_counter() - started
+
+        def search_mode():
+            nearby = rng.choice([True, False]) if mode == 'mixed' else mode == 'nearby'
+            return bot.SearchCallback(nearby=nearby).pack()
+
+        await phase('search_profiles', lambda user_id: [text_update(telegram_bot, user_id, "Поиск 🔎")])
+        await phase('start_search', lambda user_id: [callback_update(telegram_bot, user_id, search_mode())])
+        await phase('handle_reaction', lambda user_id: (
+            text_update(telegram_bot, user_id, rng.choice(["❤️", "👎"])) for _ in range(swipes)))
+        await reactions.flush()
+        await phase('show_likes', lambda user_id: [text_update(telegram_bot, user_id, "Посмотреть лайки 💌")])
+        await phase('handle_like_reaction', lambda user_id: [
+            text_update(telegram_bot, user_id, rng.choice(["❤️ Ответить взаимностью", "👎 Пропустить"]))])
+
+        report = {}
+        for flow in FLOWS:
+            samples = latencies[flow]
+            report[flow] = {
+                "updates": len(samples),
+                "p50_ms": round(percentile(samples, 0.5), 3),
+                "p99_ms": round(percentile(samples, 0.99), 3),
+                "max_ms": round(max(samples, default=0.0), 3),
+                "updates_per_s": round(len(samples) / wall[flow], 1) if wall[flow] else 0.0,
+            }
+        total = sum(len(samples) for samples in latencies.values())
+        report["total"] = {"updates": total, "updates_per_s": round(total / sum(wall.values()), 1),
+                           "bot_requests": len(session.requests)}
+        return report
+    finally:
+        await queues.close()
+        await reactions.close()
+        await database.close()
+
+
+def print_report(report):
+    print(f"{'flow':<22}{'updates':>9}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'upd/s':>10}")
+    for flow in FLOWS:
+        row = report[flow]
+        print(f"{flow:<22}{row['updates']:>9}{row['p50_ms']:>10.2f}{row['p99_ms']:>10.2f}{row['max_ms']:>10.2f}{row['updates_per_s']:>10.1f}")
+    total = report["total"]
+    print(f"{'total':<22}{total['updates']:>9}{'':>30}{total['updates_per_s']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк обработчиков свайпов на синтетической базе')
+    parser.add_argument('--db', default='bench.db', help='база из bench.generate; прогон идет на ее копии')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--swipes', type=int, default=30)
+    parser.add_argument('--mode', choices=['nearby', 'all', 'mixed'], default='mixed')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='вывести отчет одной JSON-строкой')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        shutil.copy(args.db, db_path)
+        report = asyncio.run(run(db_path, args.users, args.swipes, args.mode, args.seed))
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
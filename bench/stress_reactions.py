@@ -0,0 +1,99 @@
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import tempfile
+
+# Стресс-проверка порядка свайпов: апдейты каждого пользователя запускаются задачами подряд, без ожидания,
+# как при start_polling. Реакция k должна попасть в Likes для k-й показанной карточки, без пропусков и дублей.
+#   python -m bench.stress_reactions --db bench.db --users 30 --swipes 25
+#   python -m bench.stress_reactions --db bench.db --no-lock      # то же без UserLockMiddleware
+
+
+async def stress(db_path, users_count, swipes, seed, use_lock):
+    os.environ['DB_PATH'] = db_path
+    os.environ.setdefault('MAIN_TOKEN', '123:BENCH')
+    import bot
+    import database
+    import reactions
+    import schema
+    import userlock
+    from bench.fake import FakeSession, callback_update, text_update
+
+    if not use_lock:
+        for middleware in list(bot.dp.update.outer_middleware):
+            if isinstance(middleware, userlock.UserLockMiddleware):
+                bot.dp.update.outer_middleware.unregister(middleware)
+
+    session = FakeSession()
+    bot.bot.session = session
+    dp, telegram_bot = bot.dp, bot.bot
+    rng = random.Random(seed)
+
+    await database.connect()
+    await schema.migrate()
+    await reactions.start()
+    try:
+        async with database.reading() as db:
+            async with db.execute('SELECT UserId, PetName FROM UserProfiles WHERE Latitude IS NOT NULL') as cursor:
+                rows = await cursor.fetchall()
+            async with db.execute('SELECT COALESCE(MAX(rowid), 0) FROM Likes') as cursor:
+                last_rowid = (await cursor.fetchone())[0]
+        names = {pet_name: user_id for user_id, pet_name in rows}
+        users = rng.sample([row[0] for row in rows], min(users_count, len(rows)))
+        expected = {}
+        tasks = []
+        for user_id in users:
+            choices = [rng.choice(["❤️", "👎"]) for _ in range(swipes)]
+            expected[user_id] = ["like" if choice == "❤️" else "dislike" for choice in choices]
+            updates = [text_update(telegram_bot, user_id, "Поиск 🔎"), callback_update(telegram_bot, user_id, bot.SearchCallback(nearby=False).pack())]
+            updates += [text_update(telegram_bot, user_id, choice) for choice in choices]
+            # задачи создаются в порядке апдейтов и дальше выполняются конкурентно
+            tasks += [asyncio.create_task(dp.feed_update(telegram_bot, update)) for update in updates]
+        await asyncio.gather(*tasks)
+        await reactions.flush()
+
+        # карточки, показанные каждому пользователю, в порядке отправки
+        shown = {user_id: [] for user_id in users}
+        for request in session.requests:
+            text = getattr(request, 'caption', None) or getattr(request, 'text', None) or ''
+            chat_id = getattr(request, 'chat_id', None)
+            if chat_id in shown and text.startswith('Имя: '):
+                shown[chat_id].append(names.get(text.split('\n', 1)[0][len('Имя: '):]))
+
+        failures = 0
+        async with database.reading() as db:
+            for user_id in users:
+                async with db.execute('SELECT ViewedId, State FROM Likes WHERE UserId = ? AND rowid > ? ORDER BY rowid',
+                                      (user_id, last_rowid)) as cursor:
+                    likes = await cursor.fetchall()
+                want = list(zip(shown[user_id], expected[user_id]))
+                if [tuple(like) for like in likes] != want[:len(likes)] or len(likes) != min(len(want), swipes):
+                    failures += 1
+        print(f"пользователей: {len(users)}, свайпов: {len(users) * swipes}, "
+              f"с ошибками: {failures} ({'с' if use_lock else 'без'} UserLockMiddleware)")
+        return failures
+    finally:
+        await reactions.close()
+        await database.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Стресс-проверка записи свайпов в Likes')
+    parser.add_argument('--db', default='bench.db', help='база из bench.generate; прогон идет на ее копии')
+    parser.add_argument('--users', type=int, default=30)
+    parser.add_argument('--swipes', type=int, default=25)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-lock', action='store_true', help='снять UserLockMiddleware, чтобы увидеть гонки')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'stress.db')
+        shutil.copy(args.db, db_path)
+        failures = asyncio.run(stress(db_path, args.users, args.swipes, args.seed, not args.no_lock))
+    raise SystemExit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,115 +1,90 @@
 import asyncio
+import datetime
 from aiogram import Bot, Dispatcher, types
-from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, CallbackQuery
+from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, CallbackQuery, InputMediaPhoto
 from aiogram.filters import Command
-from geopy.distance import geodesic
-import aiosqlite
+from aiogram.filters.callback_data import CallbackData
+import cards
+import database
+import events
+import metrics
+import recorder
+import schema
 from aiogram import F
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from dotenv import load_dotenv
 import os
+import queues
+import reactions
+import search
+import seen
+import sender
+import storage
+import userlock
+import webhook
+from storage import SQLiteStorage, SessionStore
 
 load_dotenv()
 
 bot = Bot(token=os.getenv('MAIN_TOKEN'))
-dp = Dispatcher()
+bot.session.middleware(sender.RateLimitMiddleware())
+dp = Dispatcher(storage=SQLiteStorage())
+recorder.install(dp, 'UPDATES_')
+metrics.install(dp)
+userlock.install(dp)
+storage.install(dp)
+metrics.register("states", storage.metrics)
+metrics.register("reactions", reactions.metrics)
+metrics.register("cards", cards.metrics)
+metrics.register("seen", seen.metrics)
+metrics.register("events", events.metrics)
+metrics.register("sender", lambda: {"pending": sender.scheduler.pending(), "in_flight": len(sender.scheduler.tasks)})
 
 
-async def init_db():
-    async with aiosqlite.connect('petdating.db') as db:
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS UserProfiles (
-                UserId INT PRIMARY KEY,
-                PetName TEXT,
-                Age INT,
-                Breed TEXT,
-                About TEXT,
-                Photo TEXT,
-                LinkOnUserName TEXT,
-                Latitude REAL,
-                Longitude REAL,
-                ChatId INT
-            )
-        ''')
-        # await db.execute('''
-        #     INSERT INTO UserProfiles(UserId, PetName, Age, Breed, About, Photo, LinkOnUserName, Latitude, Longitude, ChatId)
-        #     VALUES
-        #     (123123, 'fwe', 12, 'fewdw', 'wcecwc', NULL, 'dkwekcow', 53.775228, 27.580525, NULL),
-        #     (1231234243, 'fwwcdwcwcde', 1332, 'fewdcwcww', 'wcewevcwc', NULL, 'dkwekccwcow', 53.557762, 27.431647, NULL),
-        #     (123, 'e', 12, 'w', 'c', NULL, 'w', 53.917259, 27.568753, NULL)
-        # ''')
-        await db.execute('''
-           CREATE TABLE IF NOT EXISTS Likes (
-               UserId INT REFERENCES UserProfiles (UserId),
-               ViewedId INT REFERENCES UserProfiles (UserId),
-               State TEXT,
-               ViewedByUser BOOLEAN DEFAULT 0
-           )
-       ''')
-        await db.execute('''
-                   CREATE TABLE IF NOT EXISTS Reports (
-                       UserId INT REFERENCES UserProfiles (UserId),
-                       ReportedId INT REFERENCES UserProfiles (UserId),
-                       ReportDescription TEXT
-                   )
-               ''')
+# сохранение профиля
+async def save_profile(user_id, pet_name, age, breed, about, photo, link, latitude, longitude, chat_id):
+    async with database.writing() as db:
         await db.execute('''
-                     CREATE TABLE IF NOT EXISTS Events (
-                         EventName TEXT,
-                         Description TEXT,
-                         EventDate DATE,
-                         Address TEXT,
-                         Photo TEXT
-                     )
-                 ''')
-        await db.commit()
+            INSERT OR REPLACE INTO UserProfiles (UserId, PetName, Age, Breed, About, Photo, LinkOnUserName, Latitude, Longitude, ChatId, Version)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, pet_name, age, breed, about, photo, link, latitude, longitude, chat_id, cards.new_version()))
+        await save_location_index(db, user_id, latitude, longitude)
+        await save_text_index(db, user_id)
+    queues.profile_changed(user_id)
+
+
+# синхронизация пространственного индекса с анкетой
+async def save_location_index(db, user_id, latitude, longitude):
+    await db.execute('DELETE FROM ProfileLocations WHERE UserId = ?', (user_id,))
+    if latitude is not None and longitude is not None:
         await db.execute('''
-                     CREATE TABLE IF NOT EXISTS Admins (
-                         AdminUserId TEXT,
-                         AdminChatId TEXT DEFAULT NULL
-                     )
-                 ''')
-        await db.commit()
-
-async def reset_db():
-    async with aiosqlite.connect('petdating.db') as db:
-        # await db.execute('DROP TABLE IF EXISTS UserProfiles')
-        await db.execute('DROP TABLE IF EXISTS Likes')
-        await db.execute('DROP TABLE IF EXISTS Events')
-        # await db.execute('DROP TABLE IF EXISTS Reports')
-        await db.commit()
+            INSERT INTO ProfileLocations (UserId, MinLat, MaxLat, MinLon, MaxLon)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, latitude, latitude, longitude, longitude))
 
 
-# сохранение профиля
-async def save_profile(user_id, pet_name, age, breed, about, photo, link, latitude, longitude, chat_id):
-    async with aiosqlite.connect('petdating.db') as db:
-        await db.execute('''
-            INSERT OR REPLACE INTO UserProfiles (UserId, PetName, Age, Breed, About, Photo, LinkOnUserName, Latitude, Longitude, ChatId)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, pet_name, age, breed, about, photo, link, latitude, longitude, chat_id))
-        await db.commit()
+# синхронизация полнотекстового индекса с полями Breed/About анкеты
+async def save_text_index(db, user_id):
+    await db.execute('DELETE FROM ProfileTexts WHERE rowid = ?', (user_id,))
+    await db.execute('''
+        INSERT INTO ProfileTexts (rowid, Breed, About)
+        SELECT UserId, Breed, About FROM UserProfiles WHERE UserId = ?
+    ''', (user_id,))
 
 
-async def get_profile_by_id(user_id):
-    async with aiosqlite.connect('petdating.db') as db:
-        async with db.execute('SELECT * FROM UserProfiles WHERE UserId = ?', (user_id,)) as cursor:
-            return await cursor.fetchone()
+# проверка по первичному ключу: анкету может удалить и бот администратора в другом процессе
+async def profile_exists(user_id):
+    async with database.reading() as db:
+        async with db.execute('SELECT 1 FROM UserProfiles WHERE UserId = ?', (user_id,)) as cursor:
+            return await cursor.fetchone() is not None
 
 async def delete_profile(user_id):
-    async with aiosqlite.connect('petdating.db') as db:
+    async with database.writing() as db:
         await db.execute('DELETE FROM UserProfiles WHERE UserId = ?', (user_id,))
-        await db.commit()
-
-# профили для поиска
-async def get_all_profiles(user_id):
-    try:
-        async with aiosqlite.connect('petdating.db') as db:
-            async with db.execute('SELECT * FROM UserProfiles WHERE UserId != ?', (user_id,)) as cursor:
-                return await cursor.fetchall()
-    except Exception as e:
-        print(f"Ошибка при получении профилей: {e}")
-        return []
+        await db.execute('DELETE FROM ProfileLocations WHERE UserId = ?', (user_id,))
+        await db.execute('DELETE FROM ProfileTexts WHERE rowid = ?', (user_id,))
+        await queues.forget_profile(db, user_id)
 
 # стандарт клавиатура
 def default_keyboard():
@@ -121,6 +96,29 @@ def default_keyboard():
     )
     return markup
 
+# данные инлайн кнопок
+class EditCallback(CallbackData, prefix="edit"):
+    field: str
+
+class SearchCallback(CallbackData, prefix="search"):
+    nearby: bool
+
+class FilterCallback(CallbackData, prefix="filter"):
+    action: str  # show, reset или поле из FILTER_PROMPTS
+
+MESSAGE_LIMIT = 4096
+
+# клавиатуры карточек не зависят от анкеты и собираются один раз
+SWIPE_KEYBOARD = ReplyKeyboardMarkup(keyboard=[
+    [KeyboardButton(text = "❤️"), KeyboardButton(text = "👎")],
+    [KeyboardButton(text = "Пожаловаться 🔞"), KeyboardButton(text = "💤")]
+], resize_keyboard=True)
+
+LIKE_KEYBOARD = ReplyKeyboardMarkup(keyboard=[
+    [KeyboardButton(text="❤️ Ответить взаимностью"), KeyboardButton(text="👎 Пропустить")],
+    [KeyboardButton(text="💤 Остановить")]
+], resize_keyboard=True)
+
 # cостояния
 class ProfileForm(StatesGroup):
     pet_name = State()
@@ -138,10 +136,17 @@ class ProfileForm(StatesGroup):
     search_all_profiles = State()
     search_nearby_profiles = State()
     waiting_for_reason = State()
+    filter_radius = State()
+    filter_age = State()
+    filter_breed = State()
 
-user_states = {}  # {user_id: {"profiles": list, "index": int, "stop": bool}}
+user_states = SessionStore('user')  # {user_id: колода из new_deck() или {"likes": [UserId], "index": int}}
 
 async def print_profile(message: Message, user_id: int, state: FSMContext):
+    card = await cards.get_card(user_id)
+    if not card:
+        await message.answer("Анкета не найдена, вы можете заполнить ее заново", reply_markup=default_keyboard())
+        return
     await message.answer("Так выглядит ваша анкета:", reply_markup=ReplyKeyboardMarkup(
         keyboard=[
             [KeyboardButton(text="Изменить анкету")], [KeyboardButton(text="Удалить анкету")],
@@ -149,14 +154,11 @@ async def print_profile(message: Message, user_id: int, state: FSMContext):
         ],
         resize_keyboard=True,
     ))
-    profile = await get_profile_by_id(user_id)
-    pet_name, age, breed, about, photo = profile[1], profile[2], profile[3], profile[4], profile[5]
-    caption = f"Имя: {pet_name}\nВозраст: {age} лет\nПорода: {breed}\nОписание: {about}"
 
-    if photo:
-        await message.answer_photo(photo, caption=caption)
+    if card.photo:
+        await message.answer_photo(card.photo, caption=card.caption)
     else:
-        await message.answer(caption)
+        await message.answer(card.caption)
 
 # /start
 @dp.message(Command("start"))
@@ -170,7 +172,7 @@ async def start_profile_creation(message: Message, state: FSMContext):
         await state.clear()
         await message.reply("Заполнение анкеты прекращено, вы можеете заполнить ее заново в любое время", reply_markup=default_keyboard())
         return
-    if await get_profile_by_id(message.from_user.id):
+    if await profile_exists(message.from_user.id):
         await print_profile(message=message, user_id=message.from_user.id, state=state)
     else:
         await message.reply("У вас еще нет анкеты, давайте ее создадим", reply_markup=ReplyKeyboardMarkup(
@@ -284,7 +286,7 @@ async def delete_user_profile(message: Message):
 # "Изменить анкету"
 @dp.message(F.text == "Изменить анкету")
 async def edit_user_profile(message: Message, state: FSMContext):
-    if not await get_profile_by_id(message.from_user.id):
+    if not await profile_exists(message.from_user.id):
         await message.reply("У вас еще нет анкеты, давайте ее создадим", reply_markup=ReplyKeyboardMarkup(
             keyboard=[
                 [KeyboardButton(text="Прекратить заполнение анкеты")]
@@ -295,12 +297,12 @@ async def edit_user_profile(message: Message, state: FSMContext):
         await state.set_state(ProfileForm.pet_name)
         return
 
-    button1 = types.InlineKeyboardButton(text="Имя", callback_data='edit_pet_name')
-    button2 = types.InlineKeyboardButton(text="Возраст", callback_data='edit_age')
-    button3 = types.InlineKeyboardButton(text="Порода", callback_data='edit_breed')
-    button4 = types.InlineKeyboardButton(text="Описание", callback_data='edit_about')
-    button5 = types.InlineKeyboardButton(text="Фото", callback_data='edit_photo')
-    button6 = types.InlineKeyboardButton(text="Локация", callback_data='edit_location')
+    button1 = types.InlineKeyboardButton(text="Имя", callback_data=EditCallback(field='pet_name').pack())
+    button2 = types.InlineKeyboardButton(text="Возраст", callback_data=EditCallback(field='age').pack())
+    button3 = types.InlineKeyboardButton(text="Порода", callback_data=EditCallback(field='breed').pack())
+    button4 = types.InlineKeyboardButton(text="Описание", callback_data=EditCallback(field='about').pack())
+    button5 = types.InlineKeyboardButton(text="Фото", callback_data=EditCallback(field='photo').pack())
+    button6 = types.InlineKeyboardButton(text="Локация", callback_data=EditCallback(field='location').pack())
     keyboard = InlineKeyboardMarkup(
         inline_keyboard=[
             [button1, button2], [button3, button4], [button5, button6]
@@ -310,52 +312,97 @@ async def edit_user_profile(message: Message, state: FSMContext):
 
     await message.reply("Что хотели бы изменить?", reply_markup=keyboard)
 
-# инлайн кнопки изменения профиля
-@dp.callback_query()
-async def process_callback(callback_query: types.CallbackQuery, state: FSMContext):
-    await bot.delete_message(chat_id=callback_query.message.chat.id, message_id=callback_query.message.message_id)
+# ответ на нажатие, удаление сообщения с кнопками и проверка анкеты идут параллельно; False, если анкеты нет
+async def acknowledge(callback_query: CallbackQuery, state: FSMContext):
+    _, _, exists = await asyncio.gather(
+        bot.answer_callback_query(callback_query.id),
+        bot.delete_message(chat_id=callback_query.message.chat.id, message_id=callback_query.message.message_id),
+        profile_exists(callback_query.from_user.id),
+    )
+    if exists:
+        return True
+    await bot.send_message(callback_query.from_user.id, "У вас еще нет анкеты, давайте ее создадим", reply_markup=ReplyKeyboardMarkup(
+        keyboard=[
+            [KeyboardButton(text="Прекратить заполнение анкеты")]
+        ],
+        resize_keyboard=True,
+    ))
+    await bot.send_message(callback_query.from_user.id, "Как зовут вашего питомца?")
+    await state.set_state(ProfileForm.pet_name)
+    return False
+
+EDIT_PROMPTS = {
+    "pet_name": (ProfileForm.edit_pet_name, "Введите новое имя:"),
+    "age": (ProfileForm.edit_age, "Введите новый возраст:"),
+    "breed": (ProfileForm.edit_breed, "Введите новую породу:"),
+    "about": (ProfileForm.edit_about, "Введите новое описание:"),
+    "photo": (ProfileForm.edit_photo, "Отправьте новое фото:"),
+    "location": (ProfileForm.edit_location, "Отправьте вашу новую локацию:"),
+}
 
-    if not await get_profile_by_id(callback_query.from_user.id):
-        await bot.send_message(callback_query.from_user.id,"У вас еще нет анкеты, давайте ее создадим", reply_markup=ReplyKeyboardMarkup(
-            keyboard=[
-                [KeyboardButton(text="Прекратить заполнение анкеты")]
-            ],
-            resize_keyboard=True,
-        ))
-        await bot.send_message(callback_query.from_user.id,"Как зовут вашего питомца?")
-        await state.set_state(ProfileForm.pet_name)
+# инлайн кнопки изменения профиля
+@dp.callback_query(EditCallback.filter())
+async def edit_profile_field(callback_query: CallbackQuery, callback_data: EditCallback, state: FSMContext):
+    if not await acknowledge(callback_query, state):
+        return
+    form_state, prompt = EDIT_PROMPTS[callback_data.field]
+    await state.set_state(form_state)
+    await bot.send_message(callback_query.from_user.id, prompt)
+
+# выбор режима поиска
+@dp.callback_query(SearchCallback.filter())
+async def start_search(callback_query: CallbackQuery, callback_data: SearchCallback, state: FSMContext):
+    if not await acknowledge(callback_query, state):
+        return
+    await start_profile_sending(callback_query.from_user.id, callback_query.message, callback_data.nearby)
+
+FILTER_PROMPTS = {
+    "radius": (ProfileForm.filter_radius, f"Введите радиус поиска в км (по умолчанию {search.MAX_DISTANCE_KM}) или «-» для сброса:"),
+    "age": (ProfileForm.filter_age, "Введите возраст или диапазон, например 2-5, или «-» для сброса:"),
+    "breed": (ProfileForm.filter_breed, "Введите породу или слова из описания, или «-» для сброса:"),
+}
+
+# кнопки фильтров поиска
+@dp.callback_query(FilterCallback.filter())
+async def change_filters(callback_query: CallbackQuery, callback_data: FilterCallback, state: FSMContext):
+    if not await acknowledge(callback_query, state):
         return
+    user_id = callback_query.from_user.id
+    if callback_data.action == "reset":
+        await save_filters(user_id, radius=None, min_age=None, max_age=None, breed=None)
+    if callback_data.action in FILTER_PROMPTS:
+        form_state, prompt = FILTER_PROMPTS[callback_data.action]
+        await state.set_state(form_state)
+        await bot.send_message(user_id, prompt)
+    else:
+        await show_filters(user_id)
+
+# кнопки из сообщений, отправленных до перехода на CallbackData
+LEGACY_CALLBACKS = {
+    **{f"edit_{field}": (edit_profile_field, EditCallback(field=field)) for field in EDIT_PROMPTS},
+    "nearby_profiles": (start_search, SearchCallback(nearby=True)),
+    "all_profiles": (start_search, SearchCallback(nearby=False)),
+    "search_filters": (change_filters, FilterCallback(action="show")),
+    **{f"filter_{action}": (change_filters, FilterCallback(action=action)) for action in ("radius", "age", "breed", "reset")},
+}
 
-    if callback_query.data == 'edit_pet_name':
-        await state.set_state(ProfileForm.edit_pet_name)
-        await bot.send_message(callback_query.from_user.id, "Введите новое имя:")
-    elif callback_query.data == 'edit_age':
-        await state.set_state(ProfileForm.edit_age)
-        await bot.send_message(callback_query.from_user.id, "Введите новый возраст:")
-    elif callback_query.data == 'edit_breed':
-        await state.set_state(ProfileForm.edit_breed)
-        await bot.send_message(callback_query.from_user.id, "Введите новую породу:")
-    elif callback_query.data == 'edit_about':
-        await state.set_state(ProfileForm.edit_about)
-        await bot.send_message(callback_query.from_user.id, "Введите новое описание:")
-    elif callback_query.data == 'edit_photo':
-        await state.set_state(ProfileForm.edit_photo)
-        await bot.send_message(callback_query.from_user.id, "Отправьте новое фото:")
-    elif callback_query.data == 'edit_location':
-        await state.set_state(ProfileForm.edit_location)
-        await bot.send_message(callback_query.from_user.id, "Отправьте вашу новую локацию:")
-    if callback_query.data == 'nearby_profiles':
-        await start_profile_sending(callback_query.from_user.id, callback_query.message, True)
-    elif callback_query.data == 'all_profiles':
-        await start_profile_sending(callback_query.from_user.id, callback_query.message, False)
-
-    await callback_query.answer()
+@dp.callback_query()
+async def legacy_callback(callback_query: CallbackQuery, state: FSMContext):
+    handler, callback_data = LEGACY_CALLBACKS.get(callback_query.data, (None, None))
+    if handler is None:
+        await callback_query.answer()
+        return
+    await handler(callback_query, callback_data, state)
 
 async def update_profile(user_id, field, value):
-    async with aiosqlite.connect('petdating.db') as db:
-        query = f"UPDATE UserProfiles SET {field} = ? WHERE UserId = ?"
-        await db.execute(query, (value, user_id))
-        await db.commit()
+    async with database.writing() as db:
+        query = f"UPDATE UserProfiles SET {field} = ?, Version = ? WHERE UserId = ?"
+        await db.execute(query, (value, cards.new_version(), user_id))
+        if field in ("Breed", "About"):
+            await save_text_index(db, user_id)
+    # от этих полей зависит, в чьи фильтры попадает анкета
+    if field in ("Age", "Breed", "About"):
+        queues.profile_changed(user_id)
 
 # обновление профиля
 @dp.message(ProfileForm.edit_pet_name)
@@ -400,12 +447,13 @@ async def update_photo(message: Message, state: FSMContext):
 async def update_location(message: Message, state: FSMContext):
     latitude = message.location.latitude if message.location else None
     longitude = message.location.longitude if message.location else None
-    async with aiosqlite.connect('petdating.db') as db:
+    async with database.writing() as db:
         await db.execute(
-            "UPDATE UserProfiles SET Latitude = ?, Longitude = ? WHERE UserId = ?",
-            (latitude, longitude, message.from_user.id),
+            "UPDATE UserProfiles SET Latitude = ?, Longitude = ?, Version = ? WHERE UserId = ?",
+            (latitude, longitude, cards.new_version(), message.from_user.id),
         )
-        await db.commit()
+        await save_location_index(db, message.from_user.id, latitude, longitude)
+    queues.profile_changed(message.from_user.id)
     await message.reply("Локация обновлена!")
     await print_profile(message=message, user_id=message.from_user.id, state=state)
     await state.clear()
@@ -413,7 +461,7 @@ async def update_location(message: Message, state: FSMContext):
 # "Поиск"
 @dp.message(F.text == "Поиск 🔎")
 async def search_profiles(message: Message, state: FSMContext):
-    if not await get_profile_by_id(message.from_user.id):
+    if not await profile_exists(message.from_user.id):
         await message.reply("У вас еще нет анкеты, давайте ее создадим", reply_markup=ReplyKeyboardMarkup(
             keyboard=[
                 [KeyboardButton(text="Прекратить заполнение анкеты")]
@@ -424,97 +472,175 @@ async def search_profiles(message: Message, state: FSMContext):
         await state.set_state(ProfileForm.pet_name)
         return
 
-    button1 = types.InlineKeyboardButton(text="Поблизости", callback_data='nearby_profiles')
-    button2 = types.InlineKeyboardButton(text="Все анкеты", callback_data='all_profiles')
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[ [button1, button2] ])
+    button1 = types.InlineKeyboardButton(text="Поблизости", callback_data=SearchCallback(nearby=True).pack())
+    button2 = types.InlineKeyboardButton(text="Все анкеты", callback_data=SearchCallback(nearby=False).pack())
+    button3 = types.InlineKeyboardButton(text="Фильтры ⚙️", callback_data=FilterCallback(action='show').pack())
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[ [button1, button2], [button3] ])
 
     await message.reply("Выберите критерии поиска", reply_markup=keyboard)
 
+# фильтры поиска: радиус (только для "Поблизости"), возраст и порода
+async def show_filters(user_id):
+    preferences = await search.get_preferences(user_id)
+    radius = preferences["radius"] or search.MAX_DISTANCE_KM
+    if preferences["min_age"] is None and preferences["max_age"] is None:
+        age = "любой"
+    elif preferences["min_age"] == preferences["max_age"]:
+        age = f"{preferences['min_age']} лет"
+    else:
+        age = f"{preferences['min_age'] or 1}-{preferences['max_age'] or '…'} лет"
+    breed = preferences["breed"] or "любая"
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text="Радиус", callback_data=FilterCallback(action='radius').pack()),
+         types.InlineKeyboardButton(text="Возраст", callback_data=FilterCallback(action='age').pack()),
+         types.InlineKeyboardButton(text="Порода", callback_data=FilterCallback(action='breed').pack())],
+        [types.InlineKeyboardButton(text="Сбросить", callback_data=FilterCallback(action='reset').pack()),
+         types.InlineKeyboardButton(text="Поблизости", callback_data=SearchCallback(nearby=True).pack()),
+         types.InlineKeyboardButton(text="Все анкеты", callback_data=SearchCallback(nearby=False).pack())]
+    ])
+    await bot.send_message(user_id, f"Фильтры поиска:\nРадиус: {radius:g} км\nВозраст: {age}\nПорода: {breed}", reply_markup=keyboard)
+
+async def save_filters(user_id, **changes):
+    preferences = await search.get_preferences(user_id)
+    preferences.update(changes)
+    if "breed" in changes:
+        preferences["breed_query"] = search.breed_query(changes["breed"]) if changes["breed"] else None
+    async with database.writing() as db:
+        await search.save_preferences(db, user_id, preferences)
+        # очереди кандидатов собраны под старые фильтры
+        await queues.forget_queues(db, user_id)
+
+@dp.message(ProfileForm.filter_radius)
+async def update_filter_radius(message: Message, state: FSMContext):
+    text = (message.text or "").strip().replace(",", ".")
+    if text == "-":
+        await save_filters(message.from_user.id, radius=None)
+    else:
+        try:
+            radius = float(text)
+        except ValueError:
+            radius = 0
+        if not 0 < radius <= 20000:
+            await message.reply("Радиус должен быть числом больше 0, попробуйте еще раз")
+            return
+        await save_filters(message.from_user.id, radius=radius)
+    await state.clear()
+    await show_filters(message.from_user.id)
+
+@dp.message(ProfileForm.filter_age)
+async def update_filter_age(message: Message, state: FSMContext):
+    text = (message.text or "").replace(" ", "")
+    if text == "-":
+        await save_filters(message.from_user.id, min_age=None, max_age=None)
+    else:
+        bounds = text.split("-", 1)
+        if not all(bound.isdigit() for bound in bounds) or int(bounds[0]) > int(bounds[-1]):
+            await message.reply("Возраст должен быть целым числом или диапазоном, например 2-5, попробуйте еще раз")
+            return
+        await save_filters(message.from_user.id, min_age=int(bounds[0]), max_age=int(bounds[-1]))
+    await state.clear()
+    await show_filters(message.from_user.id)
+
+@dp.message(ProfileForm.filter_breed)
+async def update_filter_breed(message: Message, state: FSMContext):
+    text = (message.text or "").strip()
+    if not text:
+        await message.reply("Введите породу текстом, попробуйте еще раз")
+        return
+    await save_filters(message.from_user.id, breed=None if text == "-" else text)
+    await state.clear()
+    await show_filters(message.from_user.id)
+
 @dp.message(F.text.in_({"❤️", "👎", "💤"}))
 async def handle_reaction(message: Message):
     text = message.text
     user_id = message.from_user.id
-    state = user_states.get(user_id)
+    state = await user_states.get(user_id)
 
-    if not state:
+    if not state or "window" not in state:
         await message.answer("Поиск анкет не активен", reply_markup=default_keyboard())
         return
 
     if message.text == "💤":
         state["stop"] = True
         await message.answer("Вы остановили просмотр анкет", reply_markup=default_keyboard())
-        user_states.pop(user_id, None)
+        user_states.pop(user_id)
         return
 
-    if state["index"] > 0:
-        previous_profile = state["profiles"][state["index"] - 1][0]
-        profile_id = previous_profile[0]
+    if state.get("current"):
+        profile_id = state["current"][0]
         reaction = {
             "❤️": "like",
             "👎": "dislike",
         }[message.text]
 
-        async with aiosqlite.connect('petdating.db') as db:
-            await db.execute(
-                '''INSERT OR REPLACE INTO Likes (UserId, ViewedId, State) VALUES (?, ?, ?)''',
-                (user_id, profile_id, reaction)
-            )
-            await db.commit()
+        # запись в Likes уходит в фоновую пачку, свайп не ждет commit
+        reactions.enqueue(user_id, profile_id, reaction)
 
         if text == "❤️":
-            async with aiosqlite.connect('petdating.db') as db:
-                async with db.execute("SELECT ChatId FROM UserProfiles WHERE UserId = ?", (profile_id,)) as cursor:
-                    user_info = await cursor.fetchone()
-                    if user_info:
-                        chat_id = user_info[0]
-            await bot.send_message(chat_id, "Ваша анкета понравилась пользователю!")
+            card = await cards.get_card(profile_id)
+            if card:
+                sender.notify(bot, card.chat_id, "Ваша анкета понравилась пользователю!")
 
     await send_next_profile(message, user_id)
 
+# колода анкет хранит только курсор и небольшое окно, следующие страницы берутся из заранее посчитанной очереди кандидатов
+def new_deck(nearby: bool):
+    return {"nearby": nearby, "window": [], "cursor": None, "exhausted": False, "current": None, "stop": False}
+
+async def fill_deck(user_id, state):
+    if state["window"] or state["exhausted"]:
+        return
+    page, cursor, exhausted = await queues.read_page(user_id, state["nearby"], state["cursor"])
+    state["window"] = [candidate.to_deck() for candidate in page]
+    state["cursor"] = cursor
+    state["exhausted"] = exhausted
+
 async def start_profile_sending(user_id, message: Message, show_distance: bool):
-    if show_distance:
-        profiles = await get_nearby_profiles(user_id)
-    else:
-        profiles = await get_all_profiles(user_id)
-    if not profiles:
+    # новый поиск должен видеть все уже поставленные реакции
+    await reactions.flush()
+    await queues.touch(user_id, show_distance)
+    state = new_deck(show_distance)
+    await fill_deck(user_id, state)
+    if not state["window"]:
         await message.answer("К сожалению, доступных анкет нет")
         return
 
-    user_states[user_id] = {"profiles": profiles, "index": 0, "stop": False}
+    user_states.set(user_id, state)
     await send_next_profile(message, user_id)
 
 async def send_next_profile(message: Message, user_id: int):
-    state = user_states.get(user_id)
+    state = await user_states.get(user_id)
     if not state or state["stop"]:
         await message.answer("Вы остановили просмотр анкет", reply_markup=default_keyboard())
-        user_states.pop(user_id, None)
+        user_states.pop(user_id)
         return
-    if not state or state["index"] >= len(state["profiles"]):
+    await fill_deck(user_id, state)
+    if not state["window"]:
         await message.answer("Анкеты закончились", reply_markup=default_keyboard())
-        user_states.pop(user_id, None)
+        user_states.pop(user_id)
         return
 
-    profile, distance = state["profiles"][state["index"]]
-    pet_name, age, breed, about, photo, profile_id = profile[1], profile[2], profile[3], profile[4], profile[5], profile[0]
-    caption = f"Имя: {pet_name}\nВозраст: {age} лет\nПорода: {breed}\nОписание: {about}\n📍 Расстояние: {distance:.2f} км"
+    profile_id, distance = state["current"] = state["window"].pop(0)
+    user_states.set(user_id, state)
+    # в колоде только [UserId, дистанция], текст и фото берем из кэша карточек
+    card = await cards.get_card(profile_id)
+    if not card:
+        await send_next_profile(message, user_id)
+        return
+    caption = f"{card.caption}\n📍 Расстояние: {distance:.2f} км"
 
-    keyboard = ReplyKeyboardMarkup(keyboard=[
-        [KeyboardButton(text = "❤️"), KeyboardButton(text = "👎")],
-        [KeyboardButton(text = "Пожаловаться 🔞"), KeyboardButton(text = "💤")]
-    ], resize_keyboard=True)
-    if photo:
-        await bot.send_photo(message.chat.id, photo, caption=caption, reply_markup=keyboard)
+    if card.photo:
+        await bot.send_photo(message.chat.id, card.photo, caption=caption, reply_markup=SWIPE_KEYBOARD)
     else:
-        await message.answer(caption, reply_markup=keyboard)
-
-    state["index"] += 1
+        await message.answer(caption, reply_markup=SWIPE_KEYBOARD)
 
 
 # Обработка нажатия на кнопку "пожаловаться"
 @dp.message(F.text == "Пожаловаться 🔞")
 async def handle_complaint(message: types.Message, state: FSMContext):
-    userstate = user_states.get(message.from_user.id)
-    if not userstate:
+    userstate = await user_states.get(message.from_user.id)
+    if not userstate or not userstate.get("current"):
         await message.answer("Вы не в поиске анкет", reply_markup = default_keyboard())
         return
     await message.reply("Напишите причину жалобы:", reply_markup=types.ReplyKeyboardRemove())
@@ -525,11 +651,10 @@ async def handle_complaint(message: types.Message, state: FSMContext):
 async def process_complaint(message: types.Message, state: FSMContext):
     complaint_reason = message.text
     user_id = message.from_user.id
-    userstate = user_states.get(user_id)
-    previous_profile = userstate["profiles"][userstate["index"] - 1][0]
-    profile_id = previous_profile[0]
+    userstate = await user_states.get(user_id)
+    profile_id = userstate["current"][0]
 
-    async with aiosqlite.connect('petdating.db') as db:
+    async with database.writing() as db:
         await db.execute(
             '''INSERT OR REPLACE INTO Reports (UserId, ReportedId, ReportDescription) VALUES (?, ?, ?)''',
             (user_id, profile_id, complaint_reason)
@@ -538,92 +663,32 @@ async def process_complaint(message: types.Message, state: FSMContext):
             '''INSERT OR REPLACE INTO Likes (UserId, ViewedId, State) VALUES (?, ?, ?)''',
             (user_id, profile_id, "dislike")
         )
-        await db.commit()
+        await queues.forget_pairs(db, [(user_id, profile_id)])
+        await seen.add_pairs(db, [(user_id, profile_id)])
     await message.reply("Спасибо за ваше сообщение, мы рассмотрим вашу жалобу, продолжаем поиск анкет")
 
     await state.clear()
     await send_next_profile(message, user_id)
 
-async def get_nearby_profiles(user_id, max_distance_km=100):
-    async with aiosqlite.connect('petdating.db') as db:
-        user = await get_profile_by_id(user_id)
-        if user and user[-3] and user[-2]:
-            user_location = (user[-3], user[-2])
-
-            async with db.execute('''
-                SELECT ViewedId FROM Likes WHERE UserId = ?
-                UNION
-                SELECT UserId FROM Likes WHERE ViewedId = ?
-            ''', (user_id, user_id)) as cursor:
-                excluded_ids = {row[0] for row in await cursor.fetchall()}
-
-            async with db.execute('SELECT * FROM UserProfiles WHERE UserId != ?', (user_id,)) as cursor:
-                profiles = await cursor.fetchall()
-                nearby_profiles = []
-                for profile in profiles:
-                    if profile[0] not in excluded_ids and profile[-3] and profile[-2]:
-                        profile_location = (profile[-3], profile[-2])
-                        distance = geodesic(user_location, profile_location).kilometers
-                        if distance <= max_distance_km:
-                            nearby_profiles.append((profile, distance))
-                return sorted(nearby_profiles, key=lambda x: x[1])
-        return []
-
-
-async def get_all_profiles(user_id):
-    async with aiosqlite.connect('petdating.db') as db:
-        user = await get_profile_by_id(user_id)
-        if user and user[-3] and user[-2]:
-            user_location = (user[-3], user[-2])
-
-            async with db.execute('''
-                       SELECT ViewedId FROM Likes WHERE UserId = ?
-                       UNION
-                       SELECT UserId FROM Likes WHERE ViewedId = ?
-                   ''', (user_id, user_id)) as cursor:
-                excluded_ids = {row[0] for row in await cursor.fetchall()}
-
-            async with db.execute('SELECT * FROM UserProfiles WHERE UserId != ?', (user_id,)) as cursor:
-                profiles = await cursor.fetchall()
-                all_profiles = []
-                for profile in profiles:
-                    if profile[0] not in excluded_ids and profile[-3] and profile[-2]:
-                        profile_location = (profile[-3], profile[-2])
-                        distance = geodesic(user_location, profile_location).kilometers
-                        all_profiles.append((profile, distance))
-                return all_profiles
-        return []
-
 @dp.message(F.text == "Посмотреть лайки 💌")
 async def show_likes(message: Message):
-    async with aiosqlite.connect('petdating.db') as db:
-        user_id = message.from_user.id
+    user_id = message.from_user.id
+    # взаимные непросмотренные и обычные лайки одним запросом по индексу (ViewedId, State, ViewedByUser)
+    async with database.reading() as db:
         async with db.execute('''
-                   SELECT u.LinkOnUserName, u.UserId, u.PetName, u.Age, u.Breed, u.About, u.Photo FROM Likes l
-                   JOIN UserProfiles u ON l.UserId = u.UserId WHERE l.ViewedId = ? AND l.State = 'mutual_like' AND l.ViewedByUser == 0 ''',
+                   SELECT l.rowid, l.State, u.UserId, u.PetName, u.Age, u.Breed, u.About, u.Photo, u.LinkOnUserName, u.ChatId, u.Version FROM Likes l
+                   JOIN UserProfiles u ON l.UserId = u.UserId
+                   WHERE l.ViewedId = ? AND (l.State = 'like' OR (l.State = 'mutual_like' AND l.ViewedByUser = 0)) ''',
                               (user_id,)) as cursor:
-            not_viewed_mutual_likes = await cursor.fetchall()
-            if not_viewed_mutual_likes:
-                for like in not_viewed_mutual_likes:
-                    link_on_user_name, liked_user_id, pet_name, age, breed, about, photo = like
+            rows = await cursor.fetchall()
+    not_viewed_mutual_likes = [row for row in rows if row[1] == 'mutual_like']
+    likes = [cards.from_row(row[2:]).user_id for row in rows if row[1] == 'like']
 
-                    caption = f"Имя: {pet_name}\nВозраст: {age} лет\nПорода: {breed}\nОписание: {about}\nСсылка на профиль: @{link_on_user_name}"
-
-                    if photo:
-                        await bot.send_photo(message.chat.id, photo, caption=caption)
-                    else:
-                        await bot.send_message(message.chat.id, caption)
-
-                    async with aiosqlite.connect('petdating.db') as db:
-                        await db.execute('''UPDATE Likes SET ViewedByUser = 1 WHERE UserId = ? AND ViewedId = ?''',(liked_user_id, user_id))
-                        await db.commit()
-
-        async with aiosqlite.connect('petdating.db') as db:
-            async with db.execute('''
-                SELECT u.UserId, u.PetName, u.Age, u.Breed, u.About, u.Photo FROM Likes l
-                JOIN UserProfiles u ON l.UserId = u.UserId WHERE l.ViewedId = ? AND l.State = 'like' ''', (user_id,)) as cursor:
-                likes = await cursor.fetchall()
-                await db.commit()
+    if not_viewed_mutual_likes:
+        await send_mutual_likes(message.chat.id, [cards.from_row(row[2:]) for row in not_viewed_mutual_likes])
+        rowids = [row[0] for row in not_viewed_mutual_likes]
+        async with database.writing() as db:
+            await db.execute(f'''UPDATE Likes SET ViewedByUser = 1 WHERE rowid IN ({", ".join("?" * len(rowids))})''', rowids)
 
     if not likes and not not_viewed_mutual_likes:
         await message.answer("У вас пока нет лайков", reply_markup=default_keyboard())
@@ -632,102 +697,135 @@ async def show_likes(message: Message):
         await message.answer("Это все лайки", reply_markup=default_keyboard())
         return
 
-    user_states[user_id] = {"likes": likes, "index": 0}
+    user_states.set(user_id, {"likes": likes, "index": 0})
     await send_next_like(message, user_id)
 
 
+# карточки взаимных лайков: фото альбомами до 10 штук, анкеты без фото одним сообщением
+async def send_mutual_likes(chat_id, mutual_likes):
+    photos, texts = [], []
+    for card in mutual_likes:
+        caption = f"{card.caption}\nСсылка на профиль: @{card.link}"
+        if card.photo:
+            photos.append(InputMediaPhoto(media=card.photo, caption=caption))
+        else:
+            texts.append(caption)
+
+    for i in range(0, len(photos), 10):
+        album = photos[i:i + 10]
+        if len(album) == 1:
+            await bot.send_photo(chat_id, album[0].media, caption=album[0].caption)
+        else:
+            await bot.send_media_group(chat_id, album)
+
+    text = ""
+    for caption in texts:
+        if text and len(text) + len(caption) + 2 > MESSAGE_LIMIT:
+            await bot.send_message(chat_id, text)
+            text = ""
+        text = f"{text}\n\n{caption}" if text else caption
+    if text:
+        await bot.send_message(chat_id, text)
+
+
 async def send_next_like(message: Message, user_id: int):
-    state = user_states.get(user_id)
+    state = await user_states.get(user_id)
     if not state or state["index"] >= len(state["likes"]):
         await message.answer("Все лайки просмотрены", reply_markup=default_keyboard())
-        user_states.pop(user_id, None)
+        user_states.pop(user_id)
         return
 
-    like = state["likes"][state["index"]]
-    liked_user_id, pet_name, age, breed, about, photo = like
-
-    caption = f"Имя: {pet_name}\nВозраст: {age} лет\nПорода: {breed}\nОписание: {about}"
-
-    keyboard = ReplyKeyboardMarkup(keyboard=[
-        [KeyboardButton(text="❤️ Ответить взаимностью"), KeyboardButton(text="👎 Пропустить")],
-        [KeyboardButton(text="💤 Остановить")]
-    ], resize_keyboard=True)
+    card = await cards.get_card(state["likes"][state["index"]])
+    state["index"] += 1
+    user_states.set(user_id, state)
+    if not card:
+        await send_next_like(message, user_id)
+        return
 
-    if photo:
-        await bot.send_photo(message.chat.id, photo, caption=caption, reply_markup=keyboard)
+    if card.photo:
+        await bot.send_photo(message.chat.id, card.photo, caption=card.caption, reply_markup=LIKE_KEYBOARD)
     else:
-        await message.answer(caption, reply_markup=keyboard)
-
-    state["index"] += 1
+        await message.answer(card.caption, reply_markup=LIKE_KEYBOARD)
 
 
 @dp.message(F.text.in_({"❤️ Ответить взаимностью", "👎 Пропустить", "💤 Остановить"}))
 async def handle_like_reaction(message: Message):
     user_id = message.from_user.id
-    state = user_states.get(user_id)
+    state = await user_states.get(user_id)
 
-    if not state:
+    if not state or "likes" not in state:
         await message.answer("Просмотр лайков не активен", reply_markup=default_keyboard())
         return
 
     if message.text == "💤 Остановить":
-        user_states.pop(user_id, None)
+        user_states.pop(user_id)
         await message.answer("Вы остановили просмотр лайков", reply_markup=default_keyboard())
         return
 
     # Получаем текущий лайк
-    like = state["likes"][state["index"] - 1]
-    liked_user_id = like[0]
+    liked_user_id = state["likes"][state["index"] - 1]
 
     if message.text == "❤️ Ответить взаимностью":
-        async with aiosqlite.connect('petdating.db') as db:
-            async with db.execute('SELECT ChatId, LinkOnUserName FROM UserProfiles WHERE UserId = ?', (liked_user_id,)) as cursor:
-                liked_user_info = await cursor.fetchone()
-                if liked_user_info:
-                    liked_user_chat_id = liked_user_info[0]
-                    liked_user_username = liked_user_info[1]
-                    await bot.send_message(liked_user_chat_id,
-                        "🎉 У вас взаимный лайк!")
-            await message.answer(f"Ссылка на профиль: @{liked_user_username}")
-
-            await db.execute('''INSERT INTO Likes (UserId, ViewedId, State) VALUES (?, ?, 'mutual_like')''',
-                             (user_id, liked_user_id))
-            await db.commit()
+        card = await cards.get_card(liked_user_id)
+        if card:
+            sender.notify(bot, card.chat_id, "🎉 У вас взаимный лайк!")
+            await message.answer(f"Ссылка на профиль: @{card.link}")
 
+        async with database.writing() as db:
+            await db.execute('''INSERT OR REPLACE INTO Likes (UserId, ViewedId, State) VALUES (?, ?, 'mutual_like')''',
+                             (user_id, liked_user_id))
             await db.execute('''DELETE FROM Likes WHERE UserId = ? AND ViewedId = ? AND State = 'like' ''',
                              (liked_user_id, user_id))
-
-            await db.commit()
+            await queues.forget_pairs(db, [(user_id, liked_user_id)])
+            await seen.add_pairs(db, [(user_id, liked_user_id)])
 
     await send_next_like(message, user_id)
 
 @dp.message(F.text == "События 🎉")
-async def show_likes(message: Message):
-    async with aiosqlite.connect('petdating.db') as db:
-        user_id = message.from_user.id
-        async with db.execute('''SELECT EventName, Description, EventDate, Address FROM Events WHERE EventDate >= CURRENT_DATE''') as cursor:
-            events = await cursor.fetchall()
-            if not events:
-                await message.answer("Нет доступных событий")
-                return
-            await message.answer("Запланированные события:")
-            for e in events:
-                event_name, event_description, event_date, event_address = e
-                caption = f"Название: {event_name}\nДата проведения: {event_date}\nАдрес проведения: {event_address}\nОписание: {event_description}"
-                await message.answer(caption)
+async def show_events(message: Message):
+    async with database.reading() as db:
+        async with db.execute('''
+            SELECT EventName, Description, EventDate, Address FROM Events
+            WHERE EventDate >= ? ORDER BY EventDate
+        ''', (datetime.date.today().isoformat(),)) as cursor:
+            rows = await cursor.fetchall()
+    if not rows:
+        await message.answer("Нет доступных событий")
+        return
+    # события склеиваются в сообщения до лимита Telegram вместо отдельного сообщения на каждое
+    text = "Запланированные события:"
+    for event_name, event_description, event_date, event_address in rows:
+        caption = events.caption(event_name, event_date, event_address, event_description)
+        if len(text) + len(caption) + 2 > MESSAGE_LIMIT:
+            await message.answer(text)
+            text = caption
+        else:
+            text = f"{text}\n\n{caption}"
+    await message.answer(text)
 
 
 async def main():
-    await reset_db()
-    await init_db()
-    async with aiosqlite.connect('petdating.db') as db:
-        await db.execute('''
-               INSERT INTO Admins(AdminUserId, AdminChatId)
-               VALUES
-               (929270527, 929270527)
-           ''')
-        await db.commit()
-    await dp.start_polling(bot)
+    await database.connect()
+    try:
+        await schema.migrate()
+        await reactions.start()
+        await queues.start()
+        await sender.start()
+        await metrics.start('METRICS_')
+        await events.start(bot)
+        await recorder.start()
+        if webhook.enabled('WEBHOOK_'):
+            await webhook.serve(dp, bot, 'WEBHOOK_')
+        else:
+            await dp.start_polling(bot)
+    finally:
+        await recorder.close()
+        await events.close()
+        await metrics.close()
+        await sender.close()
+        await queues.close()
+        await reactions.close()
+        await database.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -1,9 +1,22 @@
 
 import asyncio
-from aiogram import Bot, Dispatcher, types
+import datetime
+from aiogram import Bot, Dispatcher, Router, types
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.filters import Command
-import aiosqlite
+import cards
+import database
+import events
+import metrics
+import queues
+import recorder
+import schema
+from admins import AdminMiddleware
+import sender
+import storage
+import userlock
+import webhook
+from storage import SQLiteStorage, SessionStore
 from aiogram import F
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
@@ -14,8 +27,16 @@ import os
 load_dotenv()
 
 bot_admin = Bot(token=os.getenv('ADMIN_TOKEN'))
-dp_admin = Dispatcher()
+dp_admin = Dispatcher(storage=SQLiteStorage())
+recorder.install(dp_admin, 'ADMIN_UPDATES_')
+metrics.install(dp_admin)
+userlock.install(dp_admin)
+storage.install(dp_admin)
+metrics.register("states", storage.metrics)
+metrics.register("sender", lambda: {"pending": sender.scheduler.pending(), "in_flight": len(sender.scheduler.tasks)})
 other_bot = Bot(token=os.getenv('BOT_TOKEN'))
+bot_admin.session.middleware(sender.RateLimitMiddleware())
+other_bot.session.middleware(sender.RateLimitMiddleware())
 
 
 async def set_bot_commands():
@@ -34,105 +55,103 @@ class AdminStates(StatesGroup):
     event_photo = State()
     event_address = State()
 
-complaint_states = {}
+complaint_states = SessionStore('complaints')
 
-async def is_admin(user_id):
-    async with aiosqlite.connect('petdating.db') as db:
-        async with db.execute("SELECT AdminUserId FROM Admins") as cursor:
-            admins = await cursor.fetchall()
-    admin_ids = [int(admin[0]) for admin in admins]
-    return int(user_id) in admin_ids
+# доступ проверяется один раз для всех обработчиков, включая вложенные роутеры
+dp_admin.message.outer_middleware(AdminMiddleware())
 
 # Команда старта для бота-администратора
 @dp_admin.message(Command("start"))
 async def send_welcome(message: Message):
-    if await is_admin(message.from_user.id):
-        await message.answer("Привет, администратор! Ознакомиться с командами можно в меню")
-    else:
-        await message.answer("У вас нет доступа")
+    await message.answer("Привет, администратор! Ознакомиться с командами можно в меню")
+
+# Работа с жалобами: обработчики зарегистрированы один раз в отдельном роутере,
+# жалобы читаются по одной по курсору rowid, в сессии хранится только курсор и текущая жалоба
+complaints_router = Router()
+
+COMPLAINT_KEYBOARD = ReplyKeyboardMarkup(keyboard=[
+    [KeyboardButton(text="❌ Удалить анкету"), KeyboardButton(text="✅ Оставить анкету")],
+    [KeyboardButton(text="💤 Остановить")]
+], resize_keyboard=True)
+
+async def get_next_complaint(after):
+    async with database.reading() as db:
+        async with db.execute('''
+            SELECT r.rowid, r.ReportDescription, u.UserId, u.PetName, u.Age, u.Breed, u.About FROM Reports r
+            JOIN UserProfiles u ON r.ReportedId = u.UserId
+            WHERE r.rowid > ? ORDER BY r.rowid LIMIT 1''', (after,)) as cursor:
+            return await cursor.fetchone()
 
 # Команда для просмотра жалоб
-@dp_admin.message(Command("complaints"))
+@complaints_router.message(Command("complaints"))
 async def show_complaints(message: Message):
-    if not await is_admin(message.from_user.id):
-        await message.answer("У вас нет доступа")
-        return
-    async with (aiosqlite.connect('petdating.db') as db):
-        async with db.execute('''
-            SELECT r.ReportDescription, u.UserId, u.PetName, u.Age, u.Breed, u.About FROM Reports r
-            JOIN UserProfiles u ON r.ReportedId = u.UserId''') as cursor:
-            complaints = await cursor.fetchall()
+    complaint = await get_next_complaint(0)
 
-    if not complaints:
+    if not complaint:
         await message.answer("Жалоб пока нет", reply_markup=types.ReplyKeyboardRemove())
         return
 
-    complaint_states[message.from_user.id] = {"complaints": complaints, "index": 0}
-    await send_next_complaint(message)
+    await send_next_complaint(message, complaint)
 
-async def send_next_complaint(message: Message):
-    state = complaint_states.get(message.from_user.id)
-    if not state or state["index"] >= len(state["complaints"]):
+async def send_next_complaint(message: Message, complaint=None):
+    if complaint is None:
+        state = await complaint_states.get(message.from_user.id)
+        complaint = await get_next_complaint(state["cursor"]) if state else None
+    if not complaint:
         await message.answer("Все жалобы просмотрены", reply_markup=types.ReplyKeyboardRemove())
-        complaint_states.pop(message.from_user.id, None)
+        complaint_states.pop(message.from_user.id)
         return
 
-    complaint = state["complaints"][state["index"]]
-    complaint_id, user_id, pet_name, age, breed, about = complaint
-
-    caption = f"Жалоба:\nИмя: {pet_name}\nВозраст: {age} лет\nПорода: {breed}\nОписание: {about}\nПричина жалобы: {complaint_id}"
+    report_id, description, user_id, pet_name, age, breed, about = complaint
 
-    keyboard = ReplyKeyboardMarkup(keyboard=[
-        [KeyboardButton(text="❌ Удалить анкету"), KeyboardButton(text="✅ Оставить анкету")],
-        [KeyboardButton(text="💤 Остановить")]
-    ], resize_keyboard=True)
+    # анкету в админ-боте не кэшируем: изменения приходят из другого процесса
+    caption = f"Жалоба:\n{cards.caption(pet_name, age, breed, about)}\nПричина жалобы: {description}"
 
-    await message.answer(caption, reply_markup=keyboard)
+    await message.answer(caption, reply_markup=COMPLAINT_KEYBOARD)
 
-    state["index"] += 1
+    complaint_states.set(message.from_user.id, {"cursor": report_id, "current": [report_id, user_id]})
 
-    @dp_admin.message(F.text.in_({"❌ Удалить анкету", "✅ Оставить анкету", "💤 Остановить"}))
-    async def handle_complaint_action(message: Message):
-        user_id = message.from_user.id
-        state = complaint_states.get(user_id)
+@complaints_router.message(F.text.in_({"❌ Удалить анкету", "✅ Оставить анкету", "💤 Остановить"}))
+async def handle_complaint_action(message: Message):
+    user_id = message.from_user.id
+    state = await complaint_states.get(user_id)
 
-        if not state:
-            await message.answer("Просмотр жалоб не активен")
-            return
+    if not state:
+        await message.answer("Просмотр жалоб не активен")
+        return
 
-        if message.text == "💤 Остановить":
-            complaint_states.pop(user_id, None)
-            await message.answer("Вы остановили просмотр жалоб")
-            return
+    if message.text == "💤 Остановить":
+        complaint_states.pop(user_id)
+        await message.answer("Вы остановили просмотр жалоб")
+        return
 
-        complaint = state["complaints"][state["index"] - 1]
-        complaint_id, target_user_id, *_ = complaint
+    report_id, target_user_id = state["current"]
+
+    if message.text == "❌ Удалить анкету":
+        async with database.writing() as db:
+            await db.execute('DELETE FROM UserProfiles WHERE UserId = ?', (target_user_id,))
+            await db.execute('DELETE FROM ProfileLocations WHERE UserId = ?', (target_user_id,))
+            await db.execute('DELETE FROM ProfileTexts WHERE rowid = ?', (target_user_id,))
+            await db.execute('DELETE FROM Reports WHERE ReportedId = ?', (target_user_id,))
+            await queues.forget_profile(db, target_user_id)
+        await message.answer("Анкета удалена")
+        sender.notify(
+            other_bot, target_user_id,
+            "Ваша анкета была удалена администратором, вы можете заполнить новую в соответствии с требованиями",
+            on_error=lambda e: message.answer(f"Не удалось уведомить пользователя: {e}")
+        )
+    elif message.text == "✅ Оставить анкету":
+        async with database.writing() as db:
+            await db.execute('DELETE FROM Reports WHERE rowid = ?', (report_id,))
+        await message.answer("Анкета оставлена.")
 
-        async with aiosqlite.connect('petdating.db') as db:
-            if message.text == "❌ Удалить анкету":
-                await db.execute('DELETE FROM UserProfiles WHERE UserId = ?', (target_user_id,))
-                await db.execute('DELETE FROM Reports WHERE ReportedId = ?', (target_user_id,))
-                await message.answer("Анкета удалена")
-                try:
-                    await other_bot.send_message(
-                        chat_id=target_user_id,
-                        text="Ваша анкета была удалена администратором, вы можете заполнить новую в соответствии с требованиями"
-                    )
-                except Exception as e:
-                    await message.answer(f"Не удалось уведомить пользователя: {e}")
-            elif message.text == "✅ Оставить анкету":
-                await db.execute('DELETE FROM Complaints WHERE ComplaintId = ?', (complaint_id,))
-                await message.answer("Анкета оставлена.")
-            await db.commit()
+    await send_next_complaint(message)
 
-        await send_next_complaint(message)
+dp_admin.include_router(complaints_router)
 
 # Команда для добавления события
 @dp_admin.message(Command("add_event"))
 async def add_event(message: types.Message, state = FSMContext):
-    if not is_admin(message.from_user.id):
-        await message.answer("У вас нет доступа")
-        return
     await message.answer("Введите название события:", reply_markup=ReplyKeyboardMarkup(
         keyboard=[
             [KeyboardButton(text="Прекратить создание события")]
@@ -143,10 +162,6 @@ async def add_event(message: types.Message, state = FSMContext):
 
 @dp_admin.message(AdminStates.event_name)
 async def get_pet_name(message: Message, state: FSMContext):
-    if not is_admin(message.from_user.id):
-        await message.answer("У вас нет доступа")
-        await state.clear()
-        return
     if message.text == "Прекратить создание события":
         await state.clear()
         await message.reply("Создание события прекращено", reply_markup=types.ReplyKeyboardRemove())
@@ -159,10 +174,6 @@ async def get_pet_name(message: Message, state: FSMContext):
 # ввод возраста
 @dp_admin.message(AdminStates.event_address)
 async def get_age(message: Message, state: FSMContext):
-    if not is_admin(message.from_user.id):
-        await message.answer("У вас нет доступа")
-        await state.clear()
-        return
     if message.text == "Прекратить создание события":
         await state.clear()
         await message.reply("Создание события прекращено", reply_markup=types.ReplyKeyboardRemove())
@@ -175,15 +186,17 @@ async def get_age(message: Message, state: FSMContext):
 # ввод породы
 @dp_admin.message(AdminStates.event_date)
 async def get_breed(message: Message, state: FSMContext):
-    if not is_admin(message.from_user.id):
-        await message.answer("У вас нет доступа")
-        await state.clear()
-        return
     if message.text == "Прекратить создание события":
         await state.clear()
         await message.reply("Создание события прекращено", reply_markup=types.ReplyKeyboardRemove())
         return
-    event_date = message.text
+    event_date = (message.text or "").strip()
+    # даты хранятся в ISO-формате: по ним сравнивает индекс Events_EventDate
+    try:
+        datetime.date.fromisoformat(event_date)
+    except ValueError:
+        await message.reply("Введите дату в формате YYYY-MM-DD, например 2025-06-01")
+        return
     await state.update_data(event_date=event_date)
     await message.reply(f"Введите описание события")
     await state.set_state(AdminStates.event_description)
@@ -191,10 +204,6 @@ async def get_breed(message: Message, state: FSMContext):
 # ввод описания
 @dp_admin.message(AdminStates.event_description)
 async def get_about(message: Message, state: FSMContext):
-    if not is_admin(message.from_user.id):
-        await message.answer("У вас нет доступа")
-        await state.clear()
-        return
     if message.text == "Прекратить создание события":
         await state.clear()
         await message.reply("Создание события прекращено", reply_markup=types.ReplyKeyboardRemove())
@@ -209,25 +218,42 @@ async def get_about(message: Message, state: FSMContext):
 
     await state.clear()
 
-    await save_event(event_name, event_description, event_date, event_address)
+    located = await save_event(event_name, event_description, event_date, event_address)
 
     await message.answer("Так выглядит добавленное событие:", reply_markup=types.ReplyKeyboardRemove())
 
-    caption = f"Название: {event_name}\nДата проведения: {event_date}\nАдрес проведения: {event_address}\nОписание: {event_description}"
-
-    await message.answer(caption)
+    await message.answer(events.caption(event_name, event_date, event_address, event_description))
+    if not located:
+        await message.answer("Не удалось определить координаты адреса, рассылки пользователям поблизости не будет")
 
+# координаты адреса определяются один раз при сохранении, по ним основной бот делает рассылку; False, если адрес не найден
 async def save_event(event_name, event_description, event_date, event_address):
-    async with aiosqlite.connect('petdating.db') as db:
+    location = await events.geocode(event_address)
+    latitude, longitude = location or (None, None)
+    async with database.writing() as db:
         await db.execute('''
-            INSERT OR REPLACE INTO Events (EventName, Description, EventDate, Address)
-            VALUES (?, ?, ?, ?)
-        ''', (event_name, event_description, event_date, event_address))
-        await db.commit()
+            INSERT OR REPLACE INTO Events (EventName, Description, EventDate, Address, Latitude, Longitude)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (event_name, event_description, event_date, event_address, latitude, longitude))
+    return location is not None
 
 async def main():
-    await set_bot_commands()
-    await dp_admin.start_polling(bot_admin)
+    await database.connect()
+    try:
+        await schema.migrate()
+        await sender.start()
+        await metrics.start('ADMIN_METRICS_')
+        await recorder.start()
+        await set_bot_commands()
+        if webhook.enabled('ADMIN_WEBHOOK_'):
+            await webhook.serve(dp_admin, bot_admin, 'ADMIN_WEBHOOK_')
+        else:
+            await dp_admin.start_polling(bot_admin)
+    finally:
+        await recorder.close()
+        await metrics.close()
+        await sender.close()
+        await database.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
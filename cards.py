@@ -0,0 +1,93 @@
+import os
+import time
+from collections import OrderedDict
+
+import database
+
+CACHE_SIZE = int(os.getenv('CARD_CACHE_SIZE', 10000))
+
+# Готовые карточки анкет по ключу (UserId, Version). Version хранится в UserProfiles и меняется при каждой
+# записи анкеты, из какого бы процесса она ни шла, поэтому устаревшая карточка больше не находится
+# и вытесняется по LRU. Запросы, которые уже читают UserProfiles, берут Version вместе со строкой,
+# get_card сверяет ее по первичному ключу.
+
+_cards = OrderedDict()  # {(user_id, version): Card}
+
+metrics = {
+    "hits": 0,
+    "misses": 0,
+}
+
+PROFILE_COLUMNS = 'UserId, PetName, Age, Breed, About, Photo, LinkOnUserName, ChatId, Version'
+
+
+class Card:
+    __slots__ = ('user_id', 'caption', 'photo', 'link', 'chat_id')
+
+    def __init__(self, user_id, caption, photo, link, chat_id):
+        self.user_id = user_id
+        self.caption = caption
+        self.photo = photo
+        self.link = link
+        self.chat_id = chat_id
+
+
+def caption(pet_name, age, breed, about):
+    return f"Имя: {pet_name}\nВозраст: {age} лет\nПорода: {breed}\nОписание: {about}"
+
+
+# row: строка из PROFILE_COLUMNS
+def render(row):
+    user_id, pet_name, age, breed, about, photo, link, chat_id, _ = row
+    return Card(user_id, caption(pet_name, age, breed, about), photo, link, chat_id)
+
+
+# новое значение UserProfiles.Version; время в наносекундах, чтобы анкета,
+# удаленная и созданная заново, не получила прежнюю версию
+def new_version():
+    return time.time_ns()
+
+
+def _put(key, card):
+    _cards[key] = card
+    if len(_cards) > CACHE_SIZE:
+        _cards.popitem(last=False)
+
+
+def _lookup(key):
+    card = _cards.get(key)
+    if card is not None:
+        _cards.move_to_end(key)
+        metrics["hits"] += 1
+    return card
+
+
+# карточка по строке, уже прочитанной из базы вместе с другими данными
+def from_row(row):
+    key = (row[0], row[8])
+    card = _lookup(key)
+    if card is None:
+        metrics["misses"] += 1
+        card = render(row)
+        _put(key, card)
+    return card
+
+
+# карточка анкеты или None, если анкеты нет
+async def get_card(user_id):
+    async with database.reading() as db:
+        async with db.execute('SELECT Version FROM UserProfiles WHERE UserId = ?', (user_id,)) as cursor:
+            row = await cursor.fetchone()
+        if not row:
+            return None
+        card = _lookup((user_id, row[0]))
+        if card is not None:
+            return card
+        metrics["misses"] += 1
+        async with db.execute(f'SELECT {PROFILE_COLUMNS} FROM UserProfiles WHERE UserId = ?', (user_id,)) as cursor:
+            row = await cursor.fetchone()
+    if not row:
+        return None
+    card = render(row)
+    _put((user_id, row[8]), card)
+    return card
@@ -0,0 +1,157 @@
+import asyncio
+from contextlib import asynccontextmanager
+import aiosqlite
+import os
+import time
+
+import metrics
+
+DB_PATH = os.getenv('DB_PATH', 'petdating.db')
+READERS = int(os.getenv('DB_READERS', 4))
+BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', 5000))
+
+# одно соединение на запись (под замком) и небольшой пул соединений на чтение,
+# общие для bot.py и bot_admin.py
+_writer = None
+_write_lock = asyncio.Lock()
+_readers = asyncio.Queue()
+_connect_lock = asyncio.Lock()
+
+
+# обертки над соединением и курсором aiosqlite: время и число строк каждого запроса уходят в metrics
+class TimedCursor:
+    __slots__ = ('cursor', 'rows')
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.rows = 0
+
+    async def fetchone(self):
+        row = await self.cursor.fetchone()
+        if row is not None:
+            self.rows += 1
+        return row
+
+    async def fetchall(self):
+        rows = await self.cursor.fetchall()
+        self.rows += len(rows)
+        return rows
+
+    async def fetchmany(self, size=None):
+        rows = await self.cursor.fetchmany(size)
+        self.rows += len(rows)
+        return rows
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+class TimedQuery:
+    __slots__ = ('sql', 'result', 'started', 'cursor')
+
+    def __init__(self, sql, result):
+        self.sql = sql
+        self.result = result
+        self.started = time.perf_counter()
+        self.cursor = None
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    # await db.execute(...): запрос без чтения строк, считаем затронутые
+    def __await__(self):
+        return self.run().__await__()
+
+    async def run(self):
+        try:
+            cursor = await self.result
+        except Exception:
+            metrics.record_query(self.sql, self.elapsed_ms(), error=True)
+            raise
+        metrics.record_query(self.sql, self.elapsed_ms(), cursor.rowcount)
+        return cursor
+
+    # async with db.execute(...) as cursor: время до закрытия курсора, включая чтение строк
+    async def __aenter__(self):
+        try:
+            self.cursor = TimedCursor(await self.result)
+        except Exception:
+            metrics.record_query(self.sql, self.elapsed_ms(), error=True)
+            raise
+        return self.cursor
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.cursor.cursor.close()
+        metrics.record_query(self.sql, self.elapsed_ms(), self.cursor.rows, error=exc_type is not None)
+
+
+class TimedConnection:
+    __slots__ = ('connection',)
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, sql, parameters=None):
+        return TimedQuery(sql, self.connection.execute(sql, parameters))
+
+    def executemany(self, sql, parameters):
+        return TimedQuery(sql, self.connection.executemany(sql, parameters))
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+async def _open():
+    db = await aiosqlite.connect(DB_PATH)
+    await db.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+    await db.execute('PRAGMA journal_mode = WAL')
+    await db.execute('PRAGMA synchronous = NORMAL')
+    return db
+
+
+async def connect():
+    global _writer
+    async with _connect_lock:
+        if _writer is not None:
+            return
+        _writer = await _open()
+        for _ in range(READERS):
+            _readers.put_nowait(await _open())
+
+
+async def close():
+    global _writer
+    async with _connect_lock:
+        if _writer is None:
+            return
+        async with _write_lock:
+            await _writer.close()
+            _writer = None
+        for _ in range(READERS):
+            reader = await _readers.get()
+            await reader.close()
+
+
+@asynccontextmanager
+async def reading():
+    if _writer is None:
+        await connect()
+    db = await _readers.get()
+    try:
+        yield TimedConnection(db)
+    finally:
+        _readers.put_nowait(db)
+
+
+# блок записи выполняется одной транзакцией: commit при выходе, rollback при ошибке
+@asynccontextmanager
+async def writing():
+    if _writer is None:
+        await connect()
+    async with _write_lock:
+        try:
+            yield TimedConnection(_writer)
+        except BaseException:
+            await _writer.rollback()
+            raise
+        await _writer.commit()
@@ -0,0 +1,55 @@
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180  # градус дуги большого круга для haversine_km
+MERIDIAN_KM_PER_DEGREE = 110.574  # градус широты на экваторе по эллипсоиду WGS84 (geodesic)
+
+# режимы точности: сферическая формула для всех кандидатов или
+# уточнение эллипсоидом (geodesic) для ближайших exact_top_k
+FAST = 'fast'
+EXACT = 'exact'
+
+
+# расстояния (км) от точки до массива точек одним проходом haversine
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    lat1 = math.radians(latitude)
+    lat2 = np.radians(np.asarray(latitudes, dtype=np.float64))
+    dlat = lat2 - lat1
+    dlon = np.radians(np.asarray(longitudes, dtype=np.float64) - longitude)
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def batch_distances(latitude, longitude, latitudes, longitudes, accuracy=FAST, exact_top_k=None):
+    distances = haversine_km(latitude, longitude, latitudes, longitudes)
+    if accuracy == FAST or not len(distances):
+        return distances
+    if accuracy != EXACT:
+        raise ValueError(f"Неизвестный режим точности: {accuracy}")
+
+    if exact_top_k is None or exact_top_k >= len(distances):
+        nearest = np.arange(len(distances))
+    else:
+        nearest = np.argpartition(distances, exact_top_k)[:exact_top_k]
+    # geopy загружается только при первом точном расчете, а не при старте бота
+    from geopy.distance import geodesic
+    for i in nearest:
+        distances[i] = geodesic((latitude, longitude), (latitudes[i], longitudes[i])).kilometers
+    return distances
+
+
+# прямоугольник (MinLat, MaxLat, MinLon, MaxLon), в который гарантированно попадает круг радиуса radius_km;
+# берется меньшая длина градуса из сферы и эллипсоида, чтобы круг помещался и для FAST, и для EXACT расстояний
+def bounding_box(latitude, longitude, radius_km):
+    lat_delta = radius_km / min(KM_PER_DEGREE, MERIDIAN_KM_PER_DEGREE)
+    min_lat, max_lat = latitude - lat_delta, latitude + lat_delta
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90), min(max_lat, 90), -180, 180
+    lon_delta = radius_km / (KM_PER_DEGREE * math.cos(math.radians(max(abs(min_lat), abs(max_lat)))))
+    min_lon, max_lon = longitude - lon_delta, longitude + lon_delta
+    if min_lon < -180 or max_lon > 180:
+        # прямоугольник пересекает 180-й меридиан, ищем по всей долготе
+        return min_lat, max_lat, -180, 180
+    return min_lat, max_lat, min_lon, max_lon
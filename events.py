@@ -0,0 +1,149 @@
+import asyncio
+import datetime
+import os
+
+import database
+import sender
+from distance import bounding_box, haversine_km
+
+RADIUS_KM = float(os.getenv('EVENT_RADIUS_KM', 30))
+BATCH_SIZE = int(os.getenv('EVENT_BATCH_SIZE', 100))
+INTERVAL = float(os.getenv('EVENT_SCHEDULER_INTERVAL', 60))
+REMINDER_HOUR = int(os.getenv('EVENT_REMINDER_HOUR', 10))
+GEOCODER_USER_AGENT = os.getenv('GEOCODER_USER_AGENT', 'petdating-bot')
+
+# Рассылки о событиях владельцам анкет в радиусе RADIUS_KM от места проведения:
+# анонс, когда до события больше суток, и напоминание накануне (после REMINDER_HOUR часов).
+# Получатели обходятся пачками по возрастанию UserId; курсор пачки пишется в EventBroadcasts
+# до отправки, поэтому после перезапуска рассылка продолжается со следующей пачки и никому
+# не уходит повторно (сообщения пачки, не отправленные до остановки, теряются).
+# Планировщик работает в каждом экземпляре основного бота; пачку отправляет тот, кто первым
+# сдвинул курсор (claim), остальные бросают эту рассылку до следующего прохода.
+
+ANNOUNCE = 'announce'
+REMINDER = 'reminder'
+
+_task = None
+
+metrics = {
+    "broadcasts": 0,
+    "batches": 0,
+    "sent": 0,
+    "failed": 0,
+    "lost_claims": 0,
+}
+
+
+def caption(event_name, event_date, event_address, event_description):
+    return f"Название: {event_name}\nДата проведения: {event_date}\nАдрес проведения: {event_address}\nОписание: {event_description}"
+
+
+# координаты адреса или None; geopy и сеть нужны только при добавлении события
+async def geocode(address):
+    from geopy.geocoders import Nominatim
+    geolocator = Nominatim(user_agent=GEOCODER_USER_AGENT, timeout=10)
+    try:
+        location = await asyncio.to_thread(geolocator.geocode, address)
+    except Exception as e:
+        print(f"Не удалось определить координаты адреса {address}: {e}")
+        return None
+    if location is None:
+        return None
+    return location.latitude, location.longitude
+
+
+# захват следующей пачки: курсор сдвигается с previous на after, только если его не сдвинул
+# другой экземпляр бота; False — пачку (или всю рассылку) уже ведет другой экземпляр
+async def claim(event_id, kind, previous, after, done=False):
+    async with database.writing() as db:
+        await db.execute(
+            'INSERT OR IGNORE INTO EventBroadcasts (EventId, Kind, Cursor, Done) VALUES (?, ?, NULL, 0)',
+            (event_id, kind))
+        cursor = await db.execute('''
+            UPDATE EventBroadcasts SET Cursor = ?, Done = ?
+            WHERE EventId = ? AND Kind = ? AND Cursor IS ? AND Done = 0
+        ''', (after, int(done), event_id, kind, previous))
+        return cursor.rowcount > 0
+
+
+async def broadcast(bot, event, kind):
+    event_id, event_name, description, event_date, address, latitude, longitude, after = event
+    text = caption(event_name, event_date, address, description)
+    if kind == ANNOUNCE:
+        text = f"Рядом с вами пройдет событие 🎉\n{text}"
+    else:
+        text = f"Напоминаем: завтра рядом с вами событие 🎉\n{text}"
+    min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, RADIUS_KM)
+    metrics["broadcasts"] += 1
+    while True:
+        async with database.reading() as db:
+            async with db.execute('''
+                SELECT u.UserId, u.ChatId, u.Latitude, u.Longitude FROM ProfileLocations p
+                JOIN UserProfiles u ON u.UserId = p.UserId
+                WHERE p.MaxLat >= ? AND p.MinLat <= ? AND p.MaxLon >= ? AND p.MinLon <= ?
+                  AND u.ChatId IS NOT NULL AND u.UserId > ?
+                ORDER BY u.UserId LIMIT ?
+            ''', (min_lat, max_lat, min_lon, max_lon, after if after is not None else -1, BATCH_SIZE)) as cursor:
+                rows = await cursor.fetchall()
+        if not rows:
+            await claim(event_id, kind, after, after, True)
+            return
+        if not await claim(event_id, kind, after, rows[-1][0]):
+            metrics["lost_claims"] += 1
+            return
+        after = rows[-1][0]
+        distances = haversine_km(latitude, longitude, [row[2] for row in rows], [row[3] for row in rows])
+        chat_ids = [row[1] for row, distance in zip(rows, distances) if distance <= RADIUS_KM]
+        # следующая пачка ставится в очередь только после того, как эта ушла
+        failed = await sender.send_batch(bot, chat_ids, text)
+        metrics["batches"] += 1
+        metrics["sent"] += len(chat_ids) - failed
+        metrics["failed"] += failed
+
+
+# события с координатами в диапазоне дат, по которым рассылка kind еще не закончена
+async def pending_broadcasts(kind, date_from, date_to):
+    async with database.reading() as db:
+        async with db.execute('''
+            SELECT e.rowid, e.EventName, e.Description, e.EventDate, e.Address, e.Latitude, e.Longitude, b.Cursor
+            FROM Events e
+            LEFT JOIN EventBroadcasts b ON b.EventId = e.rowid AND b.Kind = ?
+            WHERE e.EventDate >= ? AND e.EventDate <= ? AND e.Latitude IS NOT NULL AND e.Longitude IS NOT NULL
+              AND COALESCE(b.Done, 0) = 0
+            ORDER BY e.EventDate
+        ''', (kind, date_from, date_to)) as cursor:
+            return await cursor.fetchall()
+
+
+async def run_due(bot, now=None):
+    now = now or datetime.datetime.now()
+    tomorrow = (now.date() + datetime.timedelta(days=1)).isoformat()
+    day_after = (now.date() + datetime.timedelta(days=2)).isoformat()
+    # события на завтра получают только напоминание
+    for event in await pending_broadcasts(ANNOUNCE, day_after, '9999-12-31'):
+        await broadcast(bot, event, ANNOUNCE)
+    if now.hour >= REMINDER_HOUR:
+        for event in await pending_broadcasts(REMINDER, tomorrow, tomorrow):
+            await broadcast(bot, event, REMINDER)
+
+
+async def _scheduler_loop(bot):
+    while True:
+        try:
+            await run_due(bot)
+        except Exception as e:
+            print(f"Ошибка при рассылке событий: {e}")
+        await asyncio.sleep(INTERVAL)
+
+
+async def start(bot):
+    global _task
+    if _task is None:
+        _task = asyncio.create_task(_scheduler_loop(bot))
+
+
+async def close():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        _task = None
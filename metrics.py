@@ -0,0 +1,194 @@
+import asyncio
+import bisect
+import json
+import os
+import re
+import time
+
+from aiogram import BaseMiddleware
+
+DUMP_INTERVAL = float(os.getenv('METRICS_INTERVAL', 60))
+
+# Задержки обработчиков и SQL-запросов копятся в гистограммах с фиксированными корзинами (мс).
+# Снимок раз в DUMP_INTERVAL секунд печатается одной JSON-строкой и отдается по GET /metrics.
+# Адрес эндпоинта у каждого бота свой (prefix: METRICS_ у основного, ADMIN_METRICS_ у бота администратора):
+#   {prefix}PORT   порт; 0 — эндпоинт выключен (по умолчанию)
+#   {prefix}HOST   где слушать (127.0.0.1)
+
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_started = time.time()
+_sources = {}  # {имя: dict или функция без аргументов} — метрики других модулей
+_task = None
+_runner = None
+
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'total', 'max', 'errors', 'rows')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.errors = 0
+        self.rows = 0
+
+    def observe(self, ms):
+        self.counts[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    # верхняя граница корзины, в которую попадает квантиль q
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.counts):
+            seen += count
+            if seen >= rank:
+                return round(min(float(bound), self.max), 3)
+        return round(self.max, 3)
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "rows": self.rows,
+            "avg_ms": round(self.total / self.count, 3) if self.count else 0.0,
+            "p50_ms": self.quantile(0.5),
+            "p99_ms": self.quantile(0.99),
+            "max_ms": round(self.max, 3),
+            "buckets": {str(bound): count for bound, count in zip(BUCKETS_MS + ('inf',), self.counts) if count},
+        }
+
+
+handlers = {}  # {имя обработчика: Histogram}
+updates = {}  # {тип апдейта: Histogram}
+queries = {}  # {нормализованный SQL: Histogram}
+_last_dump = {"time": time.time(), "updates": 0}
+
+
+def _histogram(table, name):
+    histogram = table.get(name)
+    if histogram is None:
+        histogram = table[name] = Histogram()
+    return histogram
+
+
+def query_name(sql):
+    return re.sub(r'\s+', ' ', sql).strip()[:120]
+
+
+def record_query(sql, ms, rows=0, error=False):
+    histogram = _histogram(queries, query_name(sql))
+    histogram.observe(ms)
+    histogram.rows += max(rows, 0)
+    if error:
+        histogram.errors += 1
+
+
+# внешний middleware на dp.update: поток апдейтов, полная задержка и ошибки
+class UpdateMetricsMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        histogram = _histogram(updates, event.event_type)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            histogram.errors += 1
+            raise
+        finally:
+            histogram.observe((time.perf_counter() - started) * 1000)
+
+
+# внутренний middleware на message/callback_query: задержка конкретного обработчика
+class HandlerMetricsMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else "unknown"
+        histogram = _histogram(handlers, name)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            histogram.errors += 1
+            raise
+        finally:
+            histogram.observe((time.perf_counter() - started) * 1000)
+
+
+def install(dispatcher):
+    dispatcher.update.outer_middleware(UpdateMetricsMiddleware())
+    dispatcher.message.middleware(HandlerMetricsMiddleware())
+    dispatcher.callback_query.middleware(HandlerMetricsMiddleware())
+
+
+def register(name, source):
+    _sources[name] = source
+
+
+def snapshot():
+    now = time.time()
+    total_updates = sum(histogram.count for histogram in updates.values())
+    elapsed = now - _last_dump["time"]
+    return {
+        "time": round(now, 3),
+        "uptime_s": round(now - _started, 1),
+        "updates_per_s": round((total_updates - _last_dump["updates"]) / elapsed, 3) if elapsed > 0 else 0.0,
+        "updates": {name: histogram.snapshot() for name, histogram in updates.items()},
+        "handlers": {name: histogram.snapshot() for name, histogram in handlers.items()},
+        "queries": {name: histogram.snapshot() for name, histogram in queries.items()},
+        **{name: dict(source() if callable(source) else source) for name, source in _sources.items()},
+    }
+
+
+def dump():
+    data = snapshot()
+    _last_dump["time"] = time.time()
+    _last_dump["updates"] = sum(histogram.count for histogram in updates.values())
+    print(json.dumps({"metrics": data}, ensure_ascii=False), flush=True)
+
+
+async def _dump_loop():
+    while True:
+        await asyncio.sleep(DUMP_INTERVAL)
+        try:
+            dump()
+        except Exception as e:
+            print(f"Ошибка при выводе метрик: {e}")
+
+
+async def _serve(host, port):
+    global _runner
+    from aiohttp import web
+
+    async def handle(request):
+        return web.json_response(snapshot(), dumps=lambda data: json.dumps(data, ensure_ascii=False))
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    _runner = web.AppRunner(app)
+    await _runner.setup()
+    await web.TCPSite(_runner, host, port).start()
+
+
+async def start(prefix):
+    global _task
+    if _task is None and DUMP_INTERVAL > 0:
+        _task = asyncio.create_task(_dump_loop())
+    port = int(os.getenv(f'{prefix}PORT', 0))
+    if port and _runner is None:
+        await _serve(os.getenv(f'{prefix}HOST', '127.0.0.1'), port)
+
+
+async def close():
+    global _task, _runner
+    if _task is not None:
+        _task.cancel()
+        _task = None
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
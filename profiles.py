@@ -0,0 +1,48 @@
+import numpy as np
+
+from distance import batch_distances, FAST
+
+# Анкеты в горячих путях поиска представлены только полями ранжирования (UserId, координаты, возраст).
+# Кандидаты запроса хранятся столбцами в numpy-массивах, объекты Candidate создаются только для
+# страницы колоды. Имя, текст и фото карточки подгружает cards.get_card в момент показа.
+
+RANKING_COLUMNS = 'u.UserId, u.Latitude, u.Longitude, u.Age'
+
+
+class Candidate:
+    __slots__ = ('user_id', 'latitude', 'longitude', 'age', 'distance')
+
+    def __init__(self, user_id, latitude, longitude, age=None, distance=None):
+        self.user_id = user_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.age = age
+        self.distance = distance
+
+    # запись колоды в состоянии пользователя: координаты после подсчета дистанции не нужны
+    def to_deck(self):
+        return [self.user_id, self.distance]
+
+
+class CandidateBatch:
+    __slots__ = ('user_ids', 'latitudes', 'longitudes', 'ages')
+
+    # rows: строки RANKING_COLUMNS
+    def __init__(self, rows):
+        self.user_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        self.latitudes = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows))
+        self.longitudes = np.fromiter((row[2] for row in rows), dtype=np.float64, count=len(rows))
+        self.ages = np.fromiter((-1 if row[3] is None else row[3] for row in rows), dtype=np.int32, count=len(rows))
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def distances(self, location):
+        return batch_distances(location[0], location[1], self.latitudes, self.longitudes, accuracy=FAST)
+
+    # Candidate для выбранных позиций, в порядке indices
+    def take(self, indices, distances):
+        return [Candidate(user_id, latitude, longitude, None if age < 0 else age, distance)
+                for user_id, latitude, longitude, age, distance in zip(
+                    self.user_ids[indices].tolist(), self.latitudes[indices].tolist(),
+                    self.longitudes[indices].tolist(), self.ages[indices].tolist(), distances[indices].tolist())]
@@ -0,0 +1,225 @@
+import asyncio
+import json
+import os
+import time
+
+import database
+import search
+from distance import haversine_km, EXACT
+from profiles import Candidate
+
+QUEUE_SIZE = int(os.getenv('CANDIDATE_QUEUE_SIZE', 200))
+LOW_WATERMARK = QUEUE_SIZE // 4
+REFRESH_INTERVAL = float(os.getenv('CANDIDATE_QUEUE_INTERVAL', 1.0))
+ACTIVE_TTL = float(os.getenv('CANDIDATE_QUEUE_TTL', 24 * 3600))
+
+# Для каждого активного пользователя и режима поиска (Nearby = 1 "Поблизости", 0 "Все анкеты")
+# в CandidateQueues лежит до QUEUE_SIZE ранжированных кандидатов по ключу SortKey
+# (дистанция или UserId). Фоновая задача доливает очереди по курсору из QueueUsers и
+# вставляет в уже покрытый курсором диапазон новые и переехавшие анкеты.
+
+_changed_profiles = set()
+_refill_locks = {}  # {(user_id, nearby): [asyncio.Lock, число пополнений в работе и в ожидании]}
+_wakeup = asyncio.Event()
+_task = None
+
+
+def sort_key(nearby, candidate_id, distance):
+    return distance if nearby else candidate_id
+
+
+async def refill(user_id, nearby, at_least=0):
+    key = (user_id, nearby)
+    entry = _refill_locks.get(key)
+    if entry is None:
+        entry = _refill_locks[key] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            await _refill(user_id, nearby, at_least)
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _refill_locks[key]
+
+
+async def _refill(user_id, nearby, at_least):
+    async with database.reading() as db:
+        async with db.execute('SELECT Cursor, Exhausted FROM QueueUsers WHERE UserId = ? AND Nearby = ?', (user_id, nearby)) as cursor:
+            queue_user = await cursor.fetchone()
+        async with db.execute('SELECT COUNT(*) FROM CandidateQueues WHERE UserId = ? AND Nearby = ?', (user_id, nearby)) as cursor:
+            size = (await cursor.fetchone())[0]
+    if queue_user and queue_user[1]:
+        return
+    limit = max(QUEUE_SIZE - size, at_least)
+    if limit <= 0:
+        return
+    after = json.loads(queue_user[0]) if queue_user and queue_user[0] else None
+    if nearby:
+        page, after = await search.get_nearby_profiles(user_id, accuracy=search.FAST, after=after, limit=limit)
+    else:
+        page, after = await search.get_all_profiles(user_id, after=after, limit=limit)
+    async with database.writing() as db:
+        await db.executemany('''
+            INSERT OR REPLACE INTO CandidateQueues (UserId, Nearby, SortKey, CandidateId, Distance) VALUES (?, ?, ?, ?, ?)
+        ''', [(user_id, nearby, sort_key(nearby, candidate.user_id, candidate.distance), candidate.user_id, candidate.distance)
+              for candidate in page])
+        await db.execute('''
+            INSERT INTO QueueUsers (UserId, Nearby, Cursor, Exhausted, LastUsed) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (UserId, Nearby) DO UPDATE SET Cursor = excluded.Cursor, Exhausted = excluded.Exhausted
+        ''', (user_id, nearby, json.dumps(after), int(len(page) < limit), time.time()))
+
+
+async def _read(user_id, nearby, after, limit):
+    after_condition = 'AND (q.SortKey, q.CandidateId) > (?, ?)' if after is not None else ''
+    params = (user_id, int(nearby)) + (tuple(after) if after is not None else ()) + (limit,)
+    async with database.reading() as db:
+        async with db.execute(f'''
+            SELECT q.SortKey, u.UserId, u.Latitude, u.Longitude, q.Distance FROM CandidateQueues q
+            JOIN UserProfiles u ON u.UserId = q.CandidateId
+            WHERE q.UserId = ? AND q.Nearby = ? {after_condition}
+            ORDER BY q.SortKey, q.CandidateId LIMIT ?
+        ''', params) as cursor:
+            return await cursor.fetchall()
+
+
+# страница колоды из головы очереди после курсора (SortKey, UserId); возвращает (страница, курсор, исчерпана ли очередь)
+async def read_page(user_id, nearby, after=None, limit=search.PAGE_SIZE):
+    nearby = int(nearby)
+    rows = await _read(user_id, nearby, after, limit)
+    if len(rows) < limit:
+        await refill(user_id, nearby, at_least=limit)
+        rows = await _read(user_id, nearby, after, limit)
+    page = [Candidate(user_id, latitude, longitude, distance=distance) for _, user_id, latitude, longitude, distance in rows]
+    if nearby and page:
+        user_location = await search.get_location(user_id)
+        if user_location:
+            page = search.measure_page(user_location, page, EXACT)
+    cursor = (rows[-1][0], rows[-1][1]) if rows else after
+    return page, cursor, len(rows) < limit
+
+
+async def touch(user_id, nearby):
+    async with database.writing() as db:
+        await db.execute('UPDATE QueueUsers SET LastUsed = ? WHERE UserId = ? AND Nearby = ?',
+                         (time.time(), user_id, int(nearby)))
+
+
+# собственные очереди пользователя собираются заново, например после смены фильтров поиска
+async def forget_queues(db, user_id):
+    await db.execute('DELETE FROM CandidateQueues WHERE UserId = ?', (user_id,))
+    await db.execute('DELETE FROM QueueUsers WHERE UserId = ?', (user_id,))
+
+
+# анкета удалена: убрать ее из чужих очередей и удалить ее собственные
+async def forget_profile(db, user_id):
+    await db.execute('DELETE FROM CandidateQueues WHERE CandidateId = ?', (user_id,))
+    await forget_queues(db, user_id)
+
+
+# после реакции пара больше не показывается ни одному из двоих
+async def forget_pairs(db, pairs):
+    await db.executemany('''
+        DELETE FROM CandidateQueues WHERE (UserId = ? AND CandidateId = ?) OR (UserId = ? AND CandidateId = ?)
+    ''', [(user_id, viewed_id, viewed_id, user_id) for user_id, viewed_id in pairs])
+
+
+# анкета создана, сменила локацию или поля, по которым фильтруют; обрабатывается фоновой задачей
+def profile_changed(user_id):
+    _changed_profiles.add(user_id)
+    _wakeup.set()
+
+
+async def apply_profile_changes(profile_ids):
+    async with database.writing() as db:
+        for profile_id in profile_ids:
+            await forget_profile(db, profile_id)
+
+    for profile_id in profile_ids:
+        location = await search.get_location(profile_id)
+        if not location:
+            continue
+        async with database.reading() as db:
+            async with db.execute('''
+                SELECT q.UserId, q.Nearby, q.Cursor, q.Exhausted, u.Latitude, u.Longitude, sp.Radius FROM QueueUsers q
+                JOIN UserProfiles u ON u.UserId = q.UserId
+                JOIN UserProfiles c ON c.UserId = ?
+                LEFT JOIN SearchPreferences sp ON sp.UserId = q.UserId
+                WHERE q.UserId != c.UserId AND u.Latitude IS NOT NULL AND u.Longitude IS NOT NULL
+                  AND NOT EXISTS (SELECT 1 FROM Likes l WHERE l.UserId = q.UserId AND l.ViewedId = c.UserId)
+                  AND NOT EXISTS (SELECT 1 FROM Likes l WHERE l.UserId = c.UserId AND l.ViewedId = q.UserId)
+                  AND (sp.MinAge IS NULL OR c.Age >= sp.MinAge)
+                  AND (sp.MaxAge IS NULL OR c.Age <= sp.MaxAge)
+                  AND (sp.BreedQuery IS NULL OR c.UserId IN (SELECT rowid FROM ProfileTexts WHERE ProfileTexts MATCH sp.BreedQuery))
+            ''', (profile_id,)) as cursor:
+                queue_users = await cursor.fetchall()
+        if not queue_users:
+            continue
+        distances = haversine_km(location[0], location[1],
+                                 [row[4] for row in queue_users], [row[5] for row in queue_users])
+        rows = []
+        for (user_id, nearby, after, exhausted, _, _, radius), distance in zip(queue_users, distances):
+            distance = float(distance)
+            if nearby and distance > (radius or search.MAX_DISTANCE_KM):
+                continue
+            after = json.loads(after) if after else None
+            # за курсором анкету найдет обычная доливка очереди
+            if nearby:
+                covered = after is not None and (distance, profile_id) <= tuple(after)
+            else:
+                covered = after is not None and profile_id <= after
+            if exhausted or covered:
+                rows.append((user_id, nearby, sort_key(nearby, profile_id, distance), profile_id, distance))
+        async with database.writing() as db:
+            await db.executemany('''
+                INSERT OR REPLACE INTO CandidateQueues (UserId, Nearby, SortKey, CandidateId, Distance) VALUES (?, ?, ?, ?, ?)
+            ''', rows)
+
+
+async def refresh():
+    if _changed_profiles:
+        profile_ids = list(_changed_profiles)
+        _changed_profiles.clear()
+        await apply_profile_changes(profile_ids)
+
+    async with database.writing() as db:
+        await db.execute('''
+            DELETE FROM CandidateQueues WHERE (UserId, Nearby) IN (SELECT UserId, Nearby FROM QueueUsers WHERE LastUsed < ?)
+        ''', (time.time() - ACTIVE_TTL,))
+        await db.execute('DELETE FROM QueueUsers WHERE LastUsed < ?', (time.time() - ACTIVE_TTL,))
+
+    async with database.reading() as db:
+        async with db.execute('''
+            SELECT q.UserId, q.Nearby FROM QueueUsers q
+            WHERE q.Exhausted = 0
+              AND (SELECT COUNT(*) FROM CandidateQueues c WHERE c.UserId = q.UserId AND c.Nearby = q.Nearby) < ?
+        ''', (LOW_WATERMARK,)) as cursor:
+            low_queues = await cursor.fetchall()
+    for user_id, nearby in low_queues:
+        await refill(user_id, nearby)
+
+
+async def _refresh_loop():
+    while True:
+        try:
+            await asyncio.wait_for(_wakeup.wait(), REFRESH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+        try:
+            await refresh()
+        except Exception as e:
+            print(f"Ошибка при обновлении очередей кандидатов: {e}")
+
+
+async def start():
+    global _task
+    if _task is None:
+        _task = asyncio.create_task(_refresh_loop())
+
+
+async def close():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        _task = None
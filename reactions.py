@@ -0,0 +1,88 @@
+import asyncio
+import os
+import time
+
+import database
+import queues
+import seen
+
+FLUSH_INTERVAL = float(os.getenv('REACTIONS_FLUSH_INTERVAL', 0.2))
+BATCH_SIZE = int(os.getenv('REACTIONS_BATCH_SIZE', 100))
+
+# реакции на анкеты копятся в памяти и пишутся в Likes одной транзакцией
+# раз в FLUSH_INTERVAL секунд или как только наберется BATCH_SIZE штук
+
+_queue = []  # [(UserId, ViewedId, State)]
+_wakeup = asyncio.Event()
+_flush_lock = asyncio.Lock()
+_flush_task = None
+
+metrics = {
+    "queue_depth": 0,
+    "flushes": 0,
+    "flushed_rows": 0,
+    "last_flush_ms": 0.0,
+    "max_flush_ms": 0.0,
+}
+
+
+def enqueue(user_id, viewed_id, state):
+    _queue.append((user_id, viewed_id, state))
+    metrics["queue_depth"] = len(_queue)
+    if len(_queue) >= BATCH_SIZE:
+        _wakeup.set()
+
+
+async def flush():
+    global _queue
+    async with _flush_lock:
+        if not _queue:
+            return
+        batch, _queue = _queue, []
+        started = time.perf_counter()
+        try:
+            async with database.writing() as db:
+                await db.executemany(
+                    '''INSERT OR REPLACE INTO Likes (UserId, ViewedId, State) VALUES (?, ?, ?)''',
+                    batch
+                )
+                pairs = [(user_id, viewed_id) for user_id, viewed_id, _ in batch]
+                await queues.forget_pairs(db, pairs)
+                await seen.add_pairs(db, pairs)
+        except BaseException:
+            _queue = batch + _queue
+            raise
+        finally:
+            metrics["queue_depth"] = len(_queue)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        metrics["flushes"] += 1
+        metrics["flushed_rows"] += len(batch)
+        metrics["last_flush_ms"] = elapsed_ms
+        metrics["max_flush_ms"] = max(metrics["max_flush_ms"], elapsed_ms)
+
+
+async def _flush_loop():
+    while True:
+        try:
+            await asyncio.wait_for(_wakeup.wait(), FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+        try:
+            await flush()
+        except Exception as e:
+            print(f"Ошибка при записи реакций: {e}")
+
+
+async def start():
+    global _flush_task
+    if _flush_task is None:
+        _flush_task = asyncio.create_task(_flush_loop())
+
+
+async def close():
+    global _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        _flush_task = None
+    await flush()
@@ -0,0 +1,93 @@
+import asyncio
+import gzip
+import json
+import os
+import time
+
+from aiogram import BaseMiddleware
+
+FLUSH_INTERVAL = float(os.getenv('UPDATES_RECORD_FLUSH_INTERVAL', 1.0))
+
+# Каждый входящий апдейт с временем получения пишется строкой JSONL {"t": unixtime, "update": {...}};
+# такой лог проигрывается через bench/replay.py на копии базы. Лог у каждого бота свой:
+# {prefix}RECORD_PATH, prefix UPDATES_ у основного бота и ADMIN_UPDATES_ у бота администратора
+# (не задан — запись выключена; *.gz пишется сжатым).
+
+_logs = {}  # {путь: [строки, ожидающие записи]}
+_files = {}  # {путь: открытый файл}
+_task = None
+
+
+# первый внешний middleware на dp.update: время в логе — момент получения апдейта,
+# до ожидания блокировки пользователя и загрузки FSM
+class RecordMiddleware(BaseMiddleware):
+    def __init__(self, path):
+        self.lines = _logs.setdefault(path, [])
+
+    async def __call__(self, handler, event, data):
+        update = event.model_dump_json(exclude_unset=True, by_alias=True)
+        self.lines.append(f'{{"t": {time.time():.6f}, "update": {update}}}\n')
+        return await handler(event, data)
+
+
+def open_log(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, f'{mode}t', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def read_log(path):
+    with open_log(path, 'r') as log:
+        for line in log:
+            if line.strip():
+                record = json.loads(line)
+                yield record["t"], record["update"]
+
+
+def flush():
+    for path, file in _files.items():
+        lines = _logs[path]
+        if not lines:
+            continue
+        file.writelines(lines)
+        file.flush()
+        lines.clear()
+
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception as e:
+            print(f"Ошибка при записи апдейтов: {e}")
+
+
+# вызывать сразу после создания диспетчера, до metrics.install и userlock.install
+def install(dispatcher, prefix):
+    path = os.getenv(f'{prefix}RECORD_PATH')
+    if path:
+        dispatcher.update.outer_middleware(RecordMiddleware(path))
+
+
+# открыть логи, включенные в install
+async def start():
+    global _task
+    if not _logs:
+        return
+    for path in _logs:
+        if path not in _files:
+            _files[path] = open_log(path, 'a')
+    if _task is None:
+        _task = asyncio.create_task(_flush_loop())
+
+
+async def close():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        _task = None
+    flush()
+    for file in _files.values():
+        file.close()
+    _files.clear()
@@ -0,0 +1,305 @@
+import time
+
+import database
+
+# Версионированные миграции схемы, общие для bot.py и bot_admin.py.
+# Примененные версии записаны в SchemaMigrations; при старте с актуальной схемой выполняется
+# только одно чтение, без DDL. Новые изменения схемы — только новой миграцией в конце MIGRATIONS.
+# Миграции написаны так, чтобы их можно было применить и к базе, созданной до появления SchemaMigrations.
+
+
+async def base_tables(db):
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS UserProfiles (
+            UserId INT PRIMARY KEY,
+            PetName TEXT,
+            Age INT,
+            Breed TEXT,
+            About TEXT,
+            Photo TEXT,
+            LinkOnUserName TEXT,
+            Latitude REAL,
+            Longitude REAL,
+            ChatId INT
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS Likes (
+            UserId INT REFERENCES UserProfiles (UserId),
+            ViewedId INT REFERENCES UserProfiles (UserId),
+            State TEXT,
+            ViewedByUser BOOLEAN DEFAULT 0
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS Reports (
+            UserId INT REFERENCES UserProfiles (UserId),
+            ReportedId INT REFERENCES UserProfiles (UserId),
+            ReportDescription TEXT
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS Events (
+            EventName TEXT,
+            Description TEXT,
+            EventDate DATE,
+            Address TEXT,
+            Photo TEXT
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS Admins (
+            AdminUserId TEXT,
+            AdminChatId TEXT DEFAULT NULL
+        )
+    ''')
+
+
+# пространственный индекс по координатам анкет
+async def profile_locations(db):
+    await db.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS ProfileLocations USING rtree(
+            UserId,
+            MinLat, MaxLat,
+            MinLon, MaxLon
+        )
+    ''')
+    await db.execute('''
+        INSERT INTO ProfileLocations (UserId, MinLat, MaxLat, MinLon, MaxLon)
+        SELECT UserId, Latitude, Latitude, Longitude, Longitude FROM UserProfiles
+        WHERE Latitude IS NOT NULL AND Longitude IS NOT NULL
+          AND UserId NOT IN (SELECT UserId FROM ProfileLocations)
+    ''')
+
+
+# убираем дубли в Likes/Reports и добавляем уникальные ключи и индексы
+async def likes_and_reports_keys(db):
+    await db.execute('''
+        DELETE FROM Likes WHERE rowid NOT IN (SELECT MAX(rowid) FROM Likes GROUP BY UserId, ViewedId)
+    ''')
+    await db.execute('''
+        DELETE FROM Reports WHERE rowid NOT IN (SELECT MAX(rowid) FROM Reports GROUP BY UserId, ReportedId)
+    ''')
+    await db.execute('CREATE UNIQUE INDEX IF NOT EXISTS Likes_UserId_ViewedId ON Likes (UserId, ViewedId)')
+    await db.execute('CREATE INDEX IF NOT EXISTS Likes_ViewedId_State ON Likes (ViewedId, State, ViewedByUser, UserId)')
+    await db.execute('CREATE UNIQUE INDEX IF NOT EXISTS Reports_UserId_ReportedId ON Reports (UserId, ReportedId)')
+    await db.execute('CREATE INDEX IF NOT EXISTS Reports_ReportedId ON Reports (ReportedId)')
+
+
+# состояния FSM и сессии просмотра (storage.py)
+async def state_tables(db):
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS FsmStates (
+            StorageKey TEXT PRIMARY KEY,
+            State TEXT,
+            Data TEXT
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS SessionStates (
+            Kind TEXT,
+            UserId INT,
+            Data TEXT,
+            PRIMARY KEY (Kind, UserId)
+        )
+    ''')
+
+
+# очереди кандидатов (queues.py)
+async def candidate_queues(db):
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS CandidateQueues (
+            UserId INT,
+            Nearby INT,
+            SortKey REAL,
+            CandidateId INT,
+            Distance REAL,
+            PRIMARY KEY (UserId, Nearby, SortKey, CandidateId)
+        ) WITHOUT ROWID
+    ''')
+    await db.execute('CREATE INDEX IF NOT EXISTS CandidateQueues_CandidateId ON CandidateQueues (CandidateId)')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS QueueUsers (
+            UserId INT,
+            Nearby INT,
+            Cursor TEXT,
+            Exhausted INT DEFAULT 0,
+            LastUsed REAL,
+            PRIMARY KEY (UserId, Nearby)
+        )
+    ''')
+
+
+# фильтры поиска: полнотекстовый индекс по Breed/About (rowid = UserId), индекс по возрасту и настройки пользователя
+async def search_filters(db):
+    await db.execute('CREATE VIRTUAL TABLE IF NOT EXISTS ProfileTexts USING fts5(Breed, About)')
+    await db.execute('''
+        INSERT INTO ProfileTexts (rowid, Breed, About)
+        SELECT UserId, Breed, About FROM UserProfiles
+        WHERE UserId NOT IN (SELECT rowid FROM ProfileTexts)
+    ''')
+    await db.execute('CREATE INDEX IF NOT EXISTS UserProfiles_Age ON UserProfiles (Age)')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS SearchPreferences (
+            UserId INT PRIMARY KEY,
+            Radius REAL,
+            MinAge INT,
+            MaxAge INT,
+            Breed TEXT,
+            BreedQuery TEXT
+        )
+    ''')
+
+
+# повторы апдейтов вебхука (webhook.py)
+async def processed_updates(db):
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS ProcessedUpdates (
+            BotId INT,
+            UpdateId INT,
+            ReceivedAt REAL,
+            PRIMARY KEY (BotId, UpdateId)
+        ) WITHOUT ROWID
+    ''')
+
+
+# раньше каждый запуск добавлял в Admins ту же строку
+async def unique_admins(db):
+    await db.execute('''
+        DELETE FROM Admins WHERE rowid NOT IN (SELECT MIN(rowid) FROM Admins GROUP BY AdminUserId)
+    ''')
+    await db.execute('CREATE UNIQUE INDEX IF NOT EXISTS Admins_AdminUserId ON Admins (AdminUserId)')
+    await db.execute('''
+        INSERT OR IGNORE INTO Admins (AdminUserId, AdminChatId) VALUES ('929270527', '929270527')
+    ''')
+
+
+# фильтры Блума просмотренных анкет (seen.py); строятся из Likes при первом обращении
+async def seen_filters(db):
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS SeenFilters (
+            UserId INT PRIMARY KEY,
+            Capacity INT,
+            Rate REAL,
+            Count INT,
+            Bits BLOB
+        )
+    ''')
+
+
+# колоды теперь хранят [UserId, дистанция] вместо [[UserId, Latitude, Longitude], дистанция];
+# сохраненные в старом виде сбрасываются, пользователь просто начинает поиск заново
+async def compact_decks(db):
+    await db.execute('''DELETE FROM SessionStates WHERE Kind = 'user' AND Data LIKE '%"window"%' ''')
+
+
+# координаты и индекс по дате событий, прогресс рассылок (events.py)
+async def event_broadcasts(db):
+    async with db.execute('PRAGMA table_info(Events)') as cursor:
+        columns = {row[1] for row in await cursor.fetchall()}
+    for column in ('Latitude', 'Longitude'):
+        if column not in columns:
+            await db.execute(f'ALTER TABLE Events ADD COLUMN {column} REAL')
+    await db.execute('CREATE INDEX IF NOT EXISTS Events_EventDate ON Events (EventDate)')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS EventBroadcasts (
+            EventId INT,
+            Kind TEXT,
+            Cursor INT,
+            Done INT DEFAULT 0,
+            PRIMARY KEY (EventId, Kind)
+        )
+    ''')
+
+
+# поколение фильтра: растет при каждой записи, по нему процессы замечают, что их копия устарела
+async def seen_filter_generations(db):
+    async with db.execute('PRAGMA table_info(SeenFilters)') as cursor:
+        columns = {row[1] for row in await cursor.fetchall()}
+    if 'Generation' not in columns:
+        await db.execute('ALTER TABLE SeenFilters ADD COLUMN Generation INT DEFAULT 0')
+
+
+# версия анкеты для кэша карточек (cards.py): меняется при каждой записи анкеты
+async def profile_versions(db):
+    async with db.execute('PRAGMA table_info(UserProfiles)') as cursor:
+        columns = {row[1] for row in await cursor.fetchall()}
+    if 'Version' not in columns:
+        await db.execute('ALTER TABLE UserProfiles ADD COLUMN Version INT DEFAULT 0')
+
+
+# версии строк состояний для записи с compare-and-set (storage.py)
+async def state_versions(db):
+    for table in ('FsmStates', 'SessionStates'):
+        async with db.execute(f'PRAGMA table_info({table})') as cursor:
+            columns = {row[1] for row in await cursor.fetchall()}
+        if 'Version' not in columns:
+            await db.execute(f'ALTER TABLE {table} ADD COLUMN Version INT DEFAULT 0')
+
+
+# аренда вебхука: один обслуживающий экземпляр на бота (webhook.py)
+async def webhook_leases(db):
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS WebhookLeases (
+            BotId INT PRIMARY KEY,
+            Owner TEXT,
+            ExpiresAt REAL
+        )
+    ''')
+
+
+MIGRATIONS = [
+    (1, 'base tables', base_tables),
+    (2, 'profile locations', profile_locations),
+    (3, 'likes and reports keys', likes_and_reports_keys),
+    (4, 'state tables', state_tables),
+    (5, 'candidate queues', candidate_queues),
+    (6, 'search filters', search_filters),
+    (7, 'processed updates', processed_updates),
+    (8, 'unique admins', unique_admins),
+    (9, 'seen filters', seen_filters),
+    (10, 'compact decks', compact_decks),
+    (11, 'event broadcasts', event_broadcasts),
+    (12, 'seen filter generations', seen_filter_generations),
+    (13, 'profile versions', profile_versions),
+    (14, 'state versions', state_versions),
+    (15, 'webhook leases', webhook_leases),
+]
+LATEST = MIGRATIONS[-1][0]
+
+
+async def current_version(db):
+    async with db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'SchemaMigrations'") as cursor:
+        if not await cursor.fetchone():
+            return 0
+    async with db.execute('SELECT COALESCE(MAX(Version), 0) FROM SchemaMigrations') as cursor:
+        return (await cursor.fetchone())[0]
+
+
+# применяет недостающие миграции одной транзакцией; возвращает список примененных версий
+async def migrate():
+    async with database.reading() as db:
+        if await current_version(db) >= LATEST:
+            return []
+    applied = []
+    async with database.writing() as db:
+        # BEGIN IMMEDIATE: второй процесс, стартующий одновременно, дождется и увидит новую версию
+        await db.execute('BEGIN IMMEDIATE')
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS SchemaMigrations (
+                Version INT PRIMARY KEY,
+                Name TEXT,
+                AppliedAt REAL
+            )
+        ''')
+        version = await current_version(db)
+        for migration_version, name, apply in MIGRATIONS:
+            if migration_version <= version:
+                continue
+            await apply(db)
+            await db.execute('INSERT INTO SchemaMigrations (Version, Name, AppliedAt) VALUES (?, ?, ?)',
+                             (migration_version, name, time.time()))
+            applied.append(migration_version)
+    if applied:
+        print(f"Применены миграции схемы: {applied}")
+    return applied
@@ -0,0 +1,143 @@
+import numpy as np
+
+import database
+import seen
+from distance import batch_distances, bounding_box, FAST, EXACT
+from profiles import CandidateBatch, RANKING_COLUMNS
+
+# размер страницы колоды; в режиме EXACT точный geodesic считается только для анкет страницы
+PAGE_SIZE = 20
+MAX_DISTANCE_KM = 100
+
+
+# запрос FTS5 из текста пользователя: каждое слово как префикс, все слова обязательны
+def breed_query(text):
+    words = [word.replace('"', '""') for word in text.split()]
+    return ' '.join(f'"{word}"*' for word in words) or None
+
+
+async def get_preferences(user_id):
+    async with database.reading() as db:
+        async with db.execute('SELECT Radius, MinAge, MaxAge, Breed, BreedQuery FROM SearchPreferences WHERE UserId = ?',
+                              (user_id,)) as cursor:
+            row = await cursor.fetchone()
+    if not row:
+        return {"radius": None, "min_age": None, "max_age": None, "breed": None, "breed_query": None}
+    return {"radius": row[0], "min_age": row[1], "max_age": row[2], "breed": row[3], "breed_query": row[4]}
+
+
+async def save_preferences(db, user_id, preferences):
+    await db.execute('''
+        INSERT OR REPLACE INTO SearchPreferences (UserId, Radius, MinAge, MaxAge, Breed, BreedQuery)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (user_id, preferences["radius"], preferences["min_age"], preferences["max_age"],
+          preferences["breed"], preferences["breed_query"]))
+
+
+# условия фильтров для запроса по UserProfiles u: возраст по индексу UserProfiles_Age, порода через FTS5 ProfileTexts
+def preferences_condition(preferences):
+    conditions, params = [], []
+    if preferences["min_age"] is not None:
+        conditions.append('AND u.Age >= ?')
+        params.append(preferences["min_age"])
+    if preferences["max_age"] is not None:
+        conditions.append('AND u.Age <= ?')
+        params.append(preferences["max_age"])
+    if preferences["breed_query"]:
+        conditions.append('AND u.UserId IN (SELECT rowid FROM ProfileTexts WHERE ProfileTexts MATCH ?)')
+        params.append(preferences["breed_query"])
+    return ' '.join(conditions), tuple(params)
+
+# координаты пользователя или None, если локация не указана
+async def get_location(user_id):
+    async with database.reading() as db:
+        async with db.execute('SELECT Latitude, Longitude FROM UserProfiles WHERE UserId = ?', (user_id,)) as cursor:
+            row = await cursor.fetchone()
+    if row and row[0] and row[1]:
+        return row
+    return None
+
+# порядок и курсор строятся по быстрой сферической дистанции: limit ближайших в радиусе после курсора (дистанция, UserId)
+def rank_profiles(user_location, batch, max_distance_km=None, after=None, limit=PAGE_SIZE):
+    if not len(batch):
+        return []
+    distances = batch.distances(user_location)
+    mask = np.ones(len(batch), dtype=bool) if max_distance_km is None else distances <= max_distance_km
+    if after is not None:
+        after_distance, after_id = after
+        mask &= (distances > after_distance) | ((distances == after_distance) & (batch.user_ids > after_id))
+    indices = np.flatnonzero(mask)
+    if len(indices) > limit:
+        # частичная сортировка: в lexsort попадают только кандидаты не дальше limit-го
+        cutoff = np.partition(distances[indices], limit - 1)[limit - 1]
+        indices = indices[distances[indices] <= cutoff]
+    indices = indices[np.lexsort((batch.user_ids[indices], distances[indices]))][:limit]
+    return batch.take(indices, distances)
+
+# page: список Candidate; в режиме EXACT дистанции уточняются на месте
+def measure_page(user_location, page, accuracy):
+    if accuracy == FAST or not page:
+        return page
+    distances = batch_distances(user_location[0], user_location[1],
+                                [candidate.latitude for candidate in page], [candidate.longitude for candidate in page],
+                                accuracy=accuracy)
+    for candidate, distance in zip(page, distances.tolist()):
+        candidate.distance = distance
+    return page
+
+# анкеты, с которыми пользователь уже взаимодействовал, отсекаются после запроса фильтром seen.py
+
+# страница ближайших анкет после курсора (дистанция, UserId); возвращает (страница, новый курсор)
+async def get_nearby_profiles(user_id, max_distance_km=None, accuracy=EXACT, after=None, limit=PAGE_SIZE):
+    user_location = await get_location(user_id)
+    if user_location:
+        preferences = await get_preferences(user_id)
+        if max_distance_km is None:
+            max_distance_km = preferences["radius"] or MAX_DISTANCE_KM
+        filters, filter_params = preferences_condition(preferences)
+        # кандидаты только из ячеек R*Tree внутри радиуса, точное расстояние считаем потом
+        min_lat, max_lat, min_lon, max_lon = bounding_box(user_location[0], user_location[1], max_distance_km)
+        async with database.reading() as db:
+            async with db.execute(f'''
+                SELECT {RANKING_COLUMNS} FROM ProfileLocations p
+                JOIN UserProfiles u ON u.UserId = p.UserId
+                WHERE p.MaxLat >= ? AND p.MinLat <= ? AND p.MaxLon >= ? AND p.MinLon <= ? AND u.UserId != ? {filters}
+            ''', (min_lat, max_lat, min_lon, max_lon, user_id) + filter_params) as cursor:
+                candidates = await cursor.fetchall()
+        batch = CandidateBatch(await seen.exclude_seen(user_id, candidates))
+        page = rank_profiles(user_location, batch, max_distance_km, after, limit)
+        if not page:
+            return [], after
+        cursor = (page[-1].distance, page[-1].user_id)
+        return measure_page(user_location, page, accuracy), cursor
+    return [], after
+
+
+# страница всех анкет по возрастанию UserId после курсора, без учета радиуса; возвращает (страница, новый курсор)
+async def get_all_profiles(user_id, accuracy=FAST, after=None, limit=PAGE_SIZE):
+    user_location = await get_location(user_id)
+    if user_location:
+        filters, filter_params = preferences_condition(await get_preferences(user_id))
+        candidates = []
+        # просмотренные отсеиваются после LIMIT, поэтому читаем пачками, пока не наберется limit
+        while len(candidates) < limit:
+            after_condition = 'AND u.UserId > ?' if after is not None else ''
+            params = (user_id,) + filter_params + ((after,) if after is not None else ()) + (limit,)
+            async with database.reading() as db:
+                async with db.execute(f'''
+                    SELECT {RANKING_COLUMNS} FROM UserProfiles u
+                    WHERE u.Latitude IS NOT NULL AND u.Longitude IS NOT NULL AND u.UserId != ? {filters} {after_condition}
+                    ORDER BY u.UserId LIMIT ?
+                ''', params) as cursor:
+                    rows = await cursor.fetchall()
+            if not rows:
+                break
+            unseen = await seen.exclude_seen(user_id, rows)
+            candidates += unseen[:limit - len(candidates)]
+            after = candidates[-1][0] if len(candidates) == limit else rows[-1][0]
+        if not candidates:
+            return [], after
+        batch = CandidateBatch(candidates)
+        page = batch.take(np.arange(len(batch)), batch.distances(user_location))
+        return measure_page(user_location, page, accuracy), after
+    return [], after
@@ -0,0 +1,206 @@
+import math
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+import database
+
+FALSE_POSITIVE_RATE = float(os.getenv('SEEN_FALSE_POSITIVE_RATE', 0.01))
+INITIAL_CAPACITY = int(os.getenv('SEEN_INITIAL_CAPACITY', 256))
+MEMORY_BUDGET = int(os.getenv('SEEN_MEMORY_BUDGET', 32 * 1024 * 1024))
+EXACT_BATCH = 500
+
+# Для каждого пользователя — фильтр Блума по анкетам, с которыми у него есть строка в Likes
+# в любую сторону. Поиск проверяет кандидатов по фильтру в памяти, а в Likes ходит только за
+# теми, кто в фильтр попал (совпадение или ложное срабатывание). Фильтры хранятся в SeenFilters
+# и дописываются в той же транзакции, что и Likes, поэтому промах фильтра всегда точный.
+# Фильтры пишут несколько процессов бота: запись всегда начинается с чтения строки внутри
+# транзакции, а копия в памяти используется, только пока совпадает ее Generation.
+# Когда анкет в фильтре становится больше Capacity, он пересобирается из Likes с вдвое большей емкостью.
+
+_filters = OrderedDict()  # {user_id: BloomFilter}, LRU в пределах MEMORY_BUDGET байт
+_memory = 0
+
+metrics = {
+    "filters": 0,
+    "memory_bytes": 0,
+    "checked": 0,
+    "hits": 0,
+    "false_positives": 0,
+    "rebuilds": 0,
+}
+
+
+# splitmix64: равномерно перемешивает UserId, соседние id не попадают в соседние биты
+def _mix(values):
+    z = values + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+class BloomFilter:
+    __slots__ = ('capacity', 'rate', 'count', 'hashes', 'bits', 'generation')
+
+    def __init__(self, capacity, rate=FALSE_POSITIVE_RATE, count=0, bits=None, generation=0):
+        size = max(64, math.ceil(-capacity * math.log(rate) / math.log(2) ** 2))
+        self.capacity = capacity
+        self.rate = rate
+        self.count = count
+        self.hashes = max(1, round(size / capacity * math.log(2)))
+        self.bits = bytearray((size + 7) // 8) if bits is None else bytearray(bits)
+        self.generation = generation
+
+    # позиции битов (len(ids) x hashes) двойным хешированием
+    def _positions(self, ids):
+        with np.errstate(over='ignore'):
+            h1 = _mix(np.asarray(ids, dtype=np.int64).astype(np.uint64))
+            h2 = _mix(h1) | np.uint64(1)
+            steps = np.arange(self.hashes, dtype=np.uint64)
+            return (h1[:, None] + steps[None, :] * h2[:, None]) % np.uint64(len(self.bits) * 8)
+
+    # маска кандидатов, которые могут быть в фильтре
+    def contains(self, ids):
+        if not len(ids):
+            return np.zeros(0, dtype=bool)
+        positions = self._positions(ids)
+        bits = np.frombuffer(self.bits, dtype=np.uint8)
+        return ((bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1).all(axis=1)
+
+    def add(self, ids):
+        ids = list(ids)
+        if not ids:
+            return
+        fresh = ~self.contains(ids)
+        positions = self._positions(ids).ravel()
+        bits = np.frombuffer(self.bits, dtype=np.uint8)
+        np.bitwise_or.at(bits, positions >> np.uint64(3),
+                         np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+        self.count += int(fresh.sum())
+
+    def full(self):
+        return self.count > self.capacity or self.rate != FALSE_POSITIVE_RATE
+
+
+def _cache(user_id, bloom):
+    global _memory
+    old = _filters.pop(user_id, None)
+    if old is not None:
+        _memory -= len(old.bits)
+    _filters[user_id] = bloom
+    _memory += len(bloom.bits)
+    while _memory > MEMORY_BUDGET and len(_filters) > 1:
+        _, evicted = _filters.popitem(last=False)
+        _memory -= len(evicted.bits)
+    metrics["filters"] = len(_filters)
+    metrics["memory_bytes"] = _memory
+
+
+async def _seen_ids(db, user_id):
+    async with db.execute('''
+        SELECT ViewedId FROM Likes WHERE UserId = ?
+        UNION SELECT UserId FROM Likes WHERE ViewedId = ?
+    ''', (user_id, user_id)) as cursor:
+        return [row[0] for row in await cursor.fetchall()]
+
+
+async def _build(db, user_id, capacity=None):
+    ids = await _seen_ids(db, user_id)
+    capacity = max(capacity or INITIAL_CAPACITY, INITIAL_CAPACITY)
+    while capacity < len(ids) * 2:
+        capacity *= 2
+    bloom = BloomFilter(capacity)
+    bloom.add(ids)
+    metrics["rebuilds"] += 1
+    return bloom
+
+
+async def _generation(db, user_id):
+    async with db.execute('SELECT Generation FROM SeenFilters WHERE UserId = ?', (user_id,)) as cursor:
+        row = await cursor.fetchone()
+    return (row[0] or 0) if row else None
+
+
+# вызывается внутри транзакции записи: поколение берется из строки, а не из копии в памяти
+async def _save(db, user_id, bloom):
+    bloom.generation = (await _generation(db, user_id) or 0) + 1
+    await db.execute('''
+        INSERT OR REPLACE INTO SeenFilters (UserId, Capacity, Rate, Count, Bits, Generation) VALUES (?, ?, ?, ?, ?, ?)
+    ''', (user_id, bloom.capacity, bloom.rate, bloom.count, bytes(bloom.bits), bloom.generation))
+
+
+async def _load(db, user_id):
+    async with db.execute(
+            'SELECT Capacity, Rate, Count, Bits, Generation FROM SeenFilters WHERE UserId = ?', (user_id,)) as cursor:
+        row = await cursor.fetchone()
+    return BloomFilter(row[0], row[1], row[2], row[3], row[4] or 0) if row else None
+
+
+async def get(user_id):
+    async with database.reading() as db:
+        bloom = _filters.get(user_id)
+        # копия в памяти верна, пока другой процесс не переписал фильтр
+        if bloom is not None and await _generation(db, user_id) == bloom.generation:
+            _filters.move_to_end(user_id)
+            return bloom
+        bloom = await _load(db, user_id)
+    if bloom is None or bloom.full():
+        async with database.writing() as db:
+            # BEGIN IMMEDIATE: пары, которые другой процесс допишет во время пересборки, не потеряются
+            await db.execute('BEGIN IMMEDIATE')
+            bloom = await _load(db, user_id)
+            if bloom is None or bloom.full():
+                bloom = await _build(db, user_id, bloom and bloom.count * 2)
+                await _save(db, user_id, bloom)
+    # пока шло чтение, фильтр мог загрузить и дополнить add_pairs
+    cached = _filters.get(user_id)
+    if cached is not None and cached.generation >= bloom.generation:
+        return cached
+    _cache(user_id, bloom)
+    return bloom
+
+
+# вызывается в транзакции, которая пишет пары (UserId, ViewedId) в Likes
+async def add_pairs(db, pairs):
+    added = {}
+    for user_id, viewed_id in pairs:
+        added.setdefault(user_id, set()).add(viewed_id)
+        added.setdefault(viewed_id, set()).add(user_id)
+    for user_id, ids in added.items():
+        # строка читается заново: копия в памяти может не содержать пар других процессов
+        bloom = await _load(db, user_id)
+        if bloom is None or bloom.full():
+            # Likes уже содержит новые пары этой транзакции
+            bloom = await _build(db, user_id, bloom and bloom.count * 2)
+        else:
+            bloom.add(ids)
+            if bloom.full():
+                bloom = await _build(db, user_id, bloom.count * 2)
+        await _save(db, user_id, bloom)
+        _cache(user_id, bloom)
+
+
+# кандидаты (строки с UserId первым полем), с которыми у пользователя еще нет строки в Likes
+async def exclude_seen(user_id, candidates):
+    if not candidates:
+        return candidates
+    bloom = await get(user_id)
+    maybe = bloom.contains([candidate[0] for candidate in candidates])
+    hits = [candidate[0] for candidate, hit in zip(candidates, maybe) if hit]
+    metrics["checked"] += len(candidates)
+    metrics["hits"] += len(hits)
+    if not hits:
+        return candidates
+    seen = set()
+    async with database.reading() as db:
+        for start in range(0, len(hits), EXACT_BATCH):
+            batch = hits[start:start + EXACT_BATCH]
+            marks = ', '.join('?' * len(batch))
+            async with db.execute(f'''
+                SELECT ViewedId FROM Likes WHERE UserId = ? AND ViewedId IN ({marks})
+                UNION SELECT UserId FROM Likes WHERE ViewedId = ? AND UserId IN ({marks})
+            ''', (user_id, *batch, user_id, *batch)) as cursor:
+                seen.update(row[0] for row in await cursor.fetchall())
+    metrics["false_positives"] += len(hits) - len(seen)
+    return [candidate for candidate in candidates if candidate[0] not in seen]
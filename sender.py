@@ -0,0 +1,247 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import deque
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', 30))
+CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', 1))
+CHAT_BURST = float(os.getenv('SEND_CHAT_BURST', 3))
+MAX_IN_FLIGHT = int(os.getenv('SEND_MAX_IN_FLIGHT', 10))
+DRAIN_TIMEOUT = float(os.getenv('SEND_DRAIN_TIMEOUT', 5))
+
+# очереди: ответы пользователю в текущем диалоге идут раньше уведомлений
+INTERACTIVE = 0
+NOTIFICATION = 1
+
+# запрос уже прошел через планировщик, повторно его не ставим в очередь
+_scheduled = ContextVar('scheduled', default=False)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # момент, когда можно будет отправить следующее сообщение
+    def ready_at(self, now):
+        self.refill(now)
+        wait = 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(now + wait, self.paused_until)
+
+    def take(self, now):
+        self.refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class Job:
+    __slots__ = ('chat_id', 'priority', 'send', 'future', 'key', 'on_error')
+
+    def __init__(self, chat_id, priority, send, future=None, key=None, on_error=None):
+        self.chat_id = chat_id
+        self.priority = priority
+        self.send = send
+        self.future = future
+        self.key = key
+        self.on_error = on_error
+
+
+class SendScheduler:
+    def __init__(self):
+        self.global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+        self.chat_buckets = {}
+        self.queues = {INTERACTIVE: {}, NOTIFICATION: {}}  # {очередь: {chat_id: deque[Job]}}
+        self.ready = {INTERACTIVE: [], NOTIFICATION: []}  # {очередь: heap[(ready_at, seq, chat_id)]}
+        self.pending_keys = set()
+        self.seq = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.in_flight = asyncio.Semaphore(MAX_IN_FLIGHT)
+        self.tasks = set()
+        self.task = None
+
+    def bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(CHAT_RATE, CHAT_BURST)
+        return bucket
+
+    def pending(self):
+        return sum(len(q) for queues in self.queues.values() for q in queues.values())
+
+    def submit(self, job, front=False):
+        queues = self.queues[job.priority]
+        queue = queues.get(job.chat_id)
+        if queue is None:
+            queue = queues[job.chat_id] = deque()
+            ready_at = self.bucket(job.chat_id).ready_at(time.monotonic())
+            heapq.heappush(self.ready[job.priority], (ready_at, next(self.seq), job.chat_id))
+        if front:
+            queue.appendleft(job)
+        else:
+            queue.append(job)
+        self.wakeup.set()
+
+    # следующее сообщение, которое можно отправить прямо сейчас, и время ближайшей готовности
+    def next_job(self, now):
+        next_wake = None
+        for priority in (INTERACTIVE, NOTIFICATION):
+            heap = self.ready[priority]
+            while heap and heap[0][0] <= now:
+                _, _, chat_id = heapq.heappop(heap)
+                bucket = self.bucket(chat_id)
+                ready_at = bucket.ready_at(now)
+                if ready_at > now:
+                    heapq.heappush(heap, (ready_at, next(self.seq), chat_id))
+                    continue
+                bucket.take(now)
+                queue = self.queues[priority][chat_id]
+                job = queue.popleft()
+                if queue:
+                    heapq.heappush(heap, (bucket.ready_at(now), next(self.seq), chat_id))
+                else:
+                    del self.queues[priority][chat_id]
+                return job, None
+            if heap:
+                next_wake = heap[0][0] if next_wake is None else min(next_wake, heap[0][0])
+        return None, next_wake
+
+    def evict_idle_buckets(self, now):
+        busy = set(self.queues[INTERACTIVE]) | set(self.queues[NOTIFICATION])
+        for chat_id, bucket in list(self.chat_buckets.items()):
+            if chat_id not in busy and bucket.paused_until <= now:
+                bucket.refill(now)
+                if bucket.tokens >= bucket.capacity:
+                    del self.chat_buckets[chat_id]
+
+    async def run(self):
+        last_eviction = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if now - last_eviction > 60:
+                self.evict_idle_buckets(now)
+                last_eviction = now
+            global_ready_at = self.global_bucket.ready_at(now)
+            if global_ready_at > now:
+                await asyncio.sleep(global_ready_at - now)
+                continue
+            job, next_wake = self.next_job(now)
+            if job is None:
+                self.wakeup.clear()
+                timeout = None if next_wake is None else max(next_wake - now, 0)
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.global_bucket.take(now)
+            await self.in_flight.acquire()
+            task = asyncio.create_task(self.deliver(job))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def deliver(self, job):
+        _scheduled.set(True)
+        retried = False
+        try:
+            if job.future is not None and job.future.done():
+                return
+            result = await job.send()
+        except TelegramRetryAfter as e:
+            # флуд-контроль Telegram: чат на паузе, сообщение возвращается в начало очереди
+            self.bucket(job.chat_id).pause(e.retry_after)
+            self.submit(job, front=True)
+            retried = True
+        except Exception as e:
+            if job.future is not None:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            elif job.on_error is not None:
+                await job.on_error(e)
+            else:
+                print(f"Не удалось отправить сообщение в чат {job.chat_id}: {e}")
+        else:
+            if job.future is not None and not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self.in_flight.release()
+            if not retried and job.key is not None:
+                self.pending_keys.discard(job.key)
+
+
+scheduler = SendScheduler()
+
+
+# все исходящие Send* запросы бота проходят через общие лимиты как ответы (INTERACTIVE)
+class RateLimitMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, 'chat_id', None)
+        if (_scheduled.get() or scheduler.task is None or chat_id is None
+                or not type(method).__name__.startswith('Send')):
+            return await make_request(bot, method)
+        future = asyncio.get_running_loop().create_future()
+        scheduler.submit(Job(chat_id, INTERACTIVE, lambda: make_request(bot, method), future=future))
+        return await future
+
+
+# поставить отправку в очередь уведомлений; одинаковые ожидающие уведомления (по key) склеиваются
+def schedule(chat_id, send, key=None, on_error=None):
+    if key is not None:
+        if key in scheduler.pending_keys:
+            return
+        scheduler.pending_keys.add(key)
+    scheduler.submit(Job(chat_id, NOTIFICATION, send, key=key, on_error=on_error))
+
+
+def notify(bot, chat_id, text, on_error=None, **kwargs):
+    schedule(chat_id, lambda: bot.send_message(chat_id, text, **kwargs),
+             key=(bot.id, chat_id, text), on_error=on_error)
+
+
+# пачка уведомлений одним текстом; ждет, пока все сообщения уйдут, и возвращает число неудачных
+async def send_batch(bot, chat_ids, text, **kwargs):
+    loop = asyncio.get_running_loop()
+    futures = []
+    for chat_id in chat_ids:
+        future = loop.create_future()
+        scheduler.submit(Job(chat_id, NOTIFICATION, lambda chat_id=chat_id: bot.send_message(chat_id, text, **kwargs),
+                             future=future))
+        futures.append(future)
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    return sum(1 for result in results if isinstance(result, BaseException))
+
+
+async def start():
+    if scheduler.task is None:
+        scheduler.task = asyncio.create_task(scheduler.run())
+
+
+async def close():
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    while (scheduler.pending() or scheduler.tasks) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    if scheduler.task is not None:
+        scheduler.task.cancel()
+        scheduler.task = None
+    for task in list(scheduler.tasks):
+        task.cancel()
+    # ответы, которые так и не ушли, не должны вечно ждать
+    for queues in scheduler.queues.values():
+        for queue in queues.values():
+            for job in queue:
+                if job.future is not None and not job.future.done():
+                    job.future.cancel()
@@ -0,0 +1,204 @@
+import contextvars
+import json
+from contextlib import asynccontextmanager
+from typing import Any, Mapping
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+
+import database
+
+# состояния FSM и сессии просмотра (колоды, лайки, жалобы) живут в базе, и база — единственный
+# источник правды: одного пользователя могут обслуживать несколько процессов бота.
+# В пределах апдейта (StateMiddleware) прочитанные состояния держатся в памяти апдейта, изменения
+# пишутся одной транзакцией до его завершения. Запись сверяет Version строки с прочитанной
+# (compare-and-set): если другой процесс успел изменить состояние, изменения апдейта отбрасываются
+# и он завершается StateConflict. Строки не удаляются, а очищаются, чтобы версия не начиналась заново.
+
+_scope = contextvars.ContextVar('state_scope', default=None)  # {(хранилище, ключ): [значение, версия, изменено]}
+BLIND = object()  # версия записи без чтения: set() до get() перезаписывает строку целиком
+
+metrics = {
+    "writes": 0,
+    "conflicts": 0,
+}
+
+
+class StateConflict(Exception):
+    pass
+
+
+class _Store:
+    table = None
+    key_columns = ()
+    value_columns = ()
+
+    def empty(self):
+        return None
+
+    def encode(self, value):
+        raise NotImplementedError
+
+    def decode(self, row):
+        raise NotImplementedError
+
+    async def read(self, key):
+        scope = _scope.get()
+        entry = scope.get((self, key)) if scope is not None else None
+        if entry is None:
+            where = ' AND '.join(f'{column} = ?' for column in self.key_columns)
+            async with database.reading() as db:
+                async with db.execute(f'SELECT {", ".join(self.value_columns)}, Version FROM {self.table} WHERE {where}',
+                                      key) as cursor:
+                    row = await cursor.fetchone()
+            entry = [self.decode(row) if row else self.empty(), row[-1] if row else None, False]
+            if scope is not None:
+                scope[(self, key)] = entry
+        return entry[0]
+
+    def change(self, key, value):
+        scope = _scope.get()
+        if scope is None:
+            raise RuntimeError("сессия меняется только внутри апдейта (storage.install) или storage.scope()")
+        entry = scope.get((self, key))
+        if entry is None:
+            scope[(self, key)] = [value, BLIND, True]
+        else:
+            entry[0] = value
+            entry[2] = True
+
+    # False — строку изменил другой процесс после того, как этот ее прочитал
+    async def write(self, db, key, value, version):
+        columns = (*self.key_columns, *self.value_columns, 'Version')
+        marks = ', '.join('?' * len(columns))
+        if version is BLIND:
+            updates = ', '.join(f'{column} = excluded.{column}' for column in self.value_columns)
+            await db.execute(f'''
+                INSERT INTO {self.table} ({", ".join(columns)}) VALUES ({marks})
+                ON CONFLICT ({", ".join(self.key_columns)}) DO UPDATE SET {updates}, Version = Version + 1
+            ''', (*key, *self.encode(value), 1))
+            return True
+        if version is None:
+            if value == self.empty():
+                return True
+            cursor = await db.execute(f'INSERT OR IGNORE INTO {self.table} ({", ".join(columns)}) VALUES ({marks})',
+                                      (*key, *self.encode(value), 1))
+            return cursor.rowcount > 0
+        updates = ', '.join(f'{column} = ?' for column in self.value_columns)
+        where = ' AND '.join(f'{column} = ?' for column in self.key_columns)
+        cursor = await db.execute(f'UPDATE {self.table} SET {updates}, Version = Version + 1 WHERE {where} AND Version = ?',
+                                  (*self.encode(value), *key, version))
+        return cursor.rowcount > 0
+
+
+class SQLiteStorage(_Store, BaseStorage):
+    table = 'FsmStates'
+    key_columns = ('StorageKey',)
+    value_columns = ('State', 'Data')
+
+    @staticmethod
+    def make_key(key: StorageKey):
+        return (f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id}:{key.business_connection_id}:{key.destiny}",)
+
+    def empty(self):
+        return [None, {}]
+
+    def encode(self, value):
+        return value[0], json.dumps(value[1])
+
+    def decode(self, row):
+        return [row[0], json.loads(row[1]) if row[1] else {}]
+
+    # вне апдейта (например, dp.fsm.get_context(...) из фоновой задачи) запись идет сразу своей транзакцией
+    async def set_state(self, key: StorageKey, state=None):
+        key = self.make_key(key)
+        async with scope():
+            record = list(await self.read(key))
+            record[0] = state.state if isinstance(state, State) else state
+            self.change(key, record)
+
+    async def get_state(self, key: StorageKey):
+        return (await self.read(self.make_key(key)))[0]
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]):
+        key = self.make_key(key)
+        async with scope():
+            record = list(await self.read(key))
+            record[1] = dict(data)
+            self.change(key, record)
+
+    async def get_data(self, key: StorageKey):
+        return dict((await self.read(self.make_key(key)))[1])
+
+    async def close(self):
+        pass
+
+
+# хранилище сессий одного вида ('user', 'complaints', ...) по UserId; после изменения сессии нужно вызвать set()
+class SessionStore(_Store):
+    table = 'SessionStates'
+    key_columns = ('Kind', 'UserId')
+    value_columns = ('Data',)
+
+    def __init__(self, kind):
+        self.kind = kind
+
+    def encode(self, value):
+        return (None if value is None else json.dumps(value),)
+
+    def decode(self, row):
+        return json.loads(row[0]) if row[0] else None
+
+    async def get(self, user_id):
+        return await self.read((self.kind, user_id))
+
+    def set(self, user_id, state):
+        self.change((self.kind, user_id), state)
+
+    def pop(self, user_id):
+        self.change((self.kind, user_id), None)
+
+
+async def _commit(scope):
+    changed = [(store, key, entry) for (store, key), entry in scope.items() if entry[2]]
+    if not changed:
+        return
+    async with database.writing() as db:
+        for store, key, (value, version, _) in changed:
+            if not await store.write(db, key, value, version):
+                metrics["conflicts"] += 1
+                raise StateConflict(f"{store.table} {key}: состояние изменено другим процессом")
+    metrics["writes"] += len(changed)
+
+
+# состояния, прочитанные и измененные в блоке, записываются при выходе из него одной транзакцией;
+# при исключении изменения отбрасываются
+@asynccontextmanager
+async def scope():
+    if _scope.get() is not None:
+        yield
+        return
+    states = {}
+    token = _scope.set(states)
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+    await _commit(states)
+
+
+class StateMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        async with scope():
+            return await handler(event, data)
+
+
+# ставится после UserLockMiddleware и перед FSM: состояние читается и пишется под замком пользователя
+def install(dispatcher):
+    fsm_registered = dispatcher.fsm in dispatcher.update.outer_middleware
+    if fsm_registered:
+        dispatcher.update.outer_middleware.unregister(dispatcher.fsm)
+    dispatcher.update.outer_middleware(StateMiddleware())
+    if fsm_registered:
+        dispatcher.update.outer_middleware(dispatcher.fsm)
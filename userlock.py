@@ -0,0 +1,38 @@
+import asyncio
+
+from aiogram import BaseMiddleware
+
+# Апдейты одного пользователя обрабатываются строго по очереди, разных пользователей — параллельно.
+# Замок пользователя живет, пока есть апдейты в работе или в ожидании, затем удаляется.
+
+
+class UserLockMiddleware(BaseMiddleware):
+    def __init__(self):
+        self.locks = {}  # {user_id: [asyncio.Lock, число апдейтов в работе и в ожидании]}
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        entry = self.locks.get(user.id)
+        if entry is None:
+            entry = self.locks[user.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # asyncio.Lock отдает замок ожидающим в порядке прихода, то есть в порядке апдейтов
+            async with entry[0]:
+                return await handler(event, data)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.locks[user.id]
+
+
+# замок ставится перед FSM: иначе состояние читается раньше, чем его изменит предыдущий апдейт пользователя
+def install(dispatcher):
+    fsm_registered = dispatcher.fsm in dispatcher.update.outer_middleware
+    if fsm_registered:
+        dispatcher.update.outer_middleware.unregister(dispatcher.fsm)
+    dispatcher.update.outer_middleware(UserLockMiddleware())
+    if fsm_registered:
+        dispatcher.update.outer_middleware(dispatcher.fsm)
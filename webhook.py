@@ -0,0 +1,227 @@
+import asyncio
+import os
+import socket
+import time
+import uuid
+from collections import deque
+
+from aiogram.types import Update
+from aiohttp import web
+
+import database
+import metrics
+
+# Прием апдейтов через вебхук вместо start_polling. Настройки читаются из .env с префиксом бота
+# (WEBHOOK_ для bot.py, ADMIN_WEBHOOK_ для bot_admin.py):
+#   {prefix}MODE=webhook        включить вебхук (по умолчанию polling)
+#   {prefix}URL                 публичный адрес экземпляра; если задан, вызывается setWebhook
+#   {prefix}HOST, {prefix}PORT  где слушать (0.0.0.0:8080)
+#   {prefix}PATH                путь (/webhook)
+#   {prefix}SECRET              проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+#   {prefix}CONCURRENCY         сколько апдейтов обрабатывается одновременно (50); апдейты одного пользователя
+#                               ждут в его очереди и занимают не больше одного места
+#   {prefix}MAX_PENDING         сколько принятых апдейтов может ждать; сверх этого отвечаем 503 и Telegram повторит (500)
+# Вебхук бота обслуживает ровно один экземпляр: порядок апдейтов пользователя (очереди здесь и
+# UserLockMiddleware) держится в памяти процесса, а балансировщик не умеет направлять апдейты одного
+# пользователя в один экземпляр. Это обеспечивает аренда в WebhookLeases: второй экземпляр с тем же
+# ботом не стартует, пока аренда первого не истечет (WEBHOOK_LEASE_TTL секунд без продления).
+# ProcessedUpdates отсекает только повторные доставки Telegram одного update_id.
+# В режиме polling второй экземпляр отсекает сам Telegram (getUpdates отвечает 409 Conflict).
+
+DEDUP_TTL = float(os.getenv('WEBHOOK_DEDUP_TTL', 24 * 3600))
+DRAIN_TIMEOUT = float(os.getenv('WEBHOOK_DRAIN_TIMEOUT', 10))
+LEASE_TTL = float(os.getenv('WEBHOOK_LEASE_TTL', 30))
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def config(prefix):
+    return {
+        "mode": os.getenv(f'{prefix}MODE', 'polling'),
+        "url": os.getenv(f'{prefix}URL'),
+        "host": os.getenv(f'{prefix}HOST', '0.0.0.0'),
+        "port": int(os.getenv(f'{prefix}PORT', 8080)),
+        "path": os.getenv(f'{prefix}PATH', '/webhook'),
+        "secret": os.getenv(f'{prefix}SECRET'),
+        "concurrency": int(os.getenv(f'{prefix}CONCURRENCY', 50)),
+        "max_pending": int(os.getenv(f'{prefix}MAX_PENDING', 500)),
+    }
+
+
+def enabled(prefix):
+    return config(prefix)["mode"] == 'webhook'
+
+
+# True, если апдейт получен впервые (Telegram повторяет доставку, если не дождался ответа)
+async def claim(bot_id, update_id):
+    async with database.writing() as db:
+        cursor = await db.execute('INSERT OR IGNORE INTO ProcessedUpdates (BotId, UpdateId, ReceivedAt) VALUES (?, ?, ?)',
+                                  (bot_id, update_id, time.time()))
+        return cursor.rowcount > 0
+
+
+def _user_id(update):
+    try:
+        user = getattr(update.event, 'from_user', None)
+    except LookupError:
+        return None
+    return user.id if user else None
+
+
+class WebhookServer:
+    def __init__(self, dispatcher, bot, settings):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.settings = settings
+        self.slots = asyncio.Semaphore(settings["concurrency"])
+        self.tasks = set()
+        self.mailboxes = {}  # {user_id: deque[Update]}, первый апдейт очереди сейчас обрабатывается
+        self.pending = 0  # принятые и еще не обработанные, считая те, что сейчас проверяются на повтор
+        self.metrics = {"accepted": 0, "duplicates": 0, "rejected": 0, "failed": 0}
+
+    async def handle(self, request):
+        if self.settings["secret"] and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != self.settings["secret"]:
+            return web.Response(status=401)
+        # очередь переполнена: Telegram повторит доставку позже
+        if self.pending >= self.settings["max_pending"]:
+            self.metrics["rejected"] += 1
+            return web.Response(status=503, headers={'Retry-After': '1'})
+        self.pending += 1
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+            if not await claim(self.bot.id, update.update_id):
+                self.metrics["duplicates"] += 1
+                self.pending -= 1
+                return web.Response()
+        except ValueError:
+            self.pending -= 1
+            return web.Response(status=400)
+        except BaseException:
+            self.pending -= 1
+            raise
+        self.metrics["accepted"] += 1
+        user_id = _user_id(update)
+        if user_id is None:
+            self.spawn(self.process(update))
+        elif user_id in self.mailboxes:
+            self.mailboxes[user_id].append(update)
+        else:
+            self.mailboxes[user_id] = deque([update])
+            self.spawn(self.run_mailbox(user_id))
+        return web.Response()
+
+    def spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    # апдейты пользователя по одному в порядке прихода: место в slots берет только первый из очереди,
+    # поэтому серия нажатий одного пользователя не занимает все места и не задерживает остальных
+    async def run_mailbox(self, user_id):
+        mailbox = self.mailboxes[user_id]
+        try:
+            while mailbox:
+                await self.process(mailbox[0])
+                mailbox.popleft()
+        finally:
+            del self.mailboxes[user_id]
+
+    async def process(self, update):
+        try:
+            async with self.slots:
+                await self.dispatcher.feed_update(self.bot, update)
+        except Exception as e:
+            self.metrics["failed"] += 1
+            print(f"Ошибка при обработке апдейта {update.update_id}: {e}")
+        finally:
+            self.pending -= 1
+
+    async def health(self, request):
+        return web.json_response({"pending": self.pending, **self.metrics})
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post(self.settings["path"], self.handle)
+        app.router.add_get('/healthz', self.health)
+        return app
+
+    async def drain(self):
+        deadline = time.monotonic() + DRAIN_TIMEOUT
+        while self.tasks and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        for task in list(self.tasks):
+            task.cancel()
+
+
+async def _cleanup_loop():
+    while True:
+        try:
+            async with database.writing() as db:
+                await db.execute('DELETE FROM ProcessedUpdates WHERE ReceivedAt < ?', (time.time() - DEDUP_TTL,))
+        except Exception as e:
+            print(f"Ошибка при очистке ProcessedUpdates: {e}")
+        await asyncio.sleep(min(DEDUP_TTL, 3600))
+
+
+# берет или продлевает аренду вебхука бота; False — ее держит другой экземпляр
+async def acquire_lease(bot_id):
+    now = time.time()
+    async with database.writing() as db:
+        cursor = await db.execute('''
+            INSERT INTO WebhookLeases (BotId, Owner, ExpiresAt) VALUES (?, ?, ?)
+            ON CONFLICT (BotId) DO UPDATE SET Owner = excluded.Owner, ExpiresAt = excluded.ExpiresAt
+            WHERE WebhookLeases.Owner = excluded.Owner OR WebhookLeases.ExpiresAt < ?
+        ''', (bot_id, OWNER, now + LEASE_TTL, now))
+        return cursor.rowcount > 0
+
+
+async def release_lease(bot_id):
+    async with database.writing() as db:
+        await db.execute('DELETE FROM WebhookLeases WHERE BotId = ? AND Owner = ?', (bot_id, OWNER))
+
+
+# продлевает аренду; завершается исключением, если ее перехватил другой экземпляр
+# или продлить ее не удавалось дольше LEASE_TTL (тогда ее может взять другой)
+async def _lease_loop(bot_id):
+    renewed = time.monotonic()
+    while True:
+        await asyncio.sleep(LEASE_TTL / 3)
+        try:
+            acquired = await acquire_lease(bot_id)
+        except Exception as e:
+            print(f"Ошибка при продлении аренды вебхука: {e}")
+            if time.monotonic() - renewed < LEASE_TTL:
+                continue
+            raise RuntimeError(f"Аренда вебхука бота {bot_id} истекла") from e
+        renewed = time.monotonic()
+        if not acquired:
+            raise RuntimeError(f"Аренду вебхука бота {bot_id} перехватил другой экземпляр")
+
+
+# работает до отмены или потери аренды; вебхук в Telegram не снимается, чтобы апдейты копились
+# у Telegram до перезапуска
+async def serve(dispatcher, bot, prefix):
+    settings = config(prefix)
+    if not await acquire_lease(bot.id):
+        raise RuntimeError(f"Вебхук бота {bot.id} уже обслуживает другой экземпляр; "
+                           f"запустите один экземпляр или дождитесь истечения аренды ({LEASE_TTL:g} с)")
+    server = WebhookServer(dispatcher, bot, settings)
+    metrics.register("webhook", lambda: {"pending": server.pending, **server.metrics})
+    runner = web.AppRunner(server.app())
+    await runner.setup()
+    await web.TCPSite(runner, settings["host"], settings["port"]).start()
+    cleanup = asyncio.create_task(_cleanup_loop())
+    try:
+        if settings["url"]:
+            await bot.set_webhook(
+                settings["url"].rstrip('/') + settings["path"],
+                secret_token=settings["secret"],
+                allowed_updates=dispatcher.resolve_used_update_types(),
+                max_connections=min(100, settings["concurrency"]),
+            )
+        print(f"Вебхук слушает {settings['host']}:{settings['port']}{settings['path']}")
+        await _lease_loop(bot.id)
+    finally:
+        cleanup.cancel()
+        await runner.cleanup()
+        await server.drain()
+        await release_lease(bot.id)